@@ -0,0 +1,104 @@
+"""
+Conversion of numpy arrays to OCC arrays (TColgp, TColStd) and back.
+pythonOCC does not provide access to memory of OCC arrays, so numpy arrays
+are converted to python numbers by one call of tolist() and OCC arrays are
+filled by the shortest possible loop. All builders of curves and surfaces
+should use these functions instead of their own SetValue() loops.
+"""
+
+import numpy as np
+
+from OCC.gp import gp_Pnt
+from OCC.TColgp import TColgp_Array1OfPnt, TColgp_Array2OfPnt
+from OCC.TColStd import TColStd_Array1OfReal, TColStd_Array1OfInteger, TColStd_Array2OfReal
+
+def points_to_array1(points):
+    """
+    Create TColgp_Array1OfPnt from numpy array of points (n, 3)
+    """
+    points = np.asarray(points, dtype=np.float64)
+    array = TColgp_Array1OfPnt(1, len(points))
+    for index, point in enumerate(points.tolist(), 1):
+        array.SetValue(index, gp_Pnt(*point))
+    return array
+
+def points_to_array2(points):
+    """
+    Create TColgp_Array2OfPnt from numpy array of points (nu, nv, 3)
+    """
+    points = np.asarray(points, dtype=np.float64)
+    array = TColgp_Array2OfPnt(1, points.shape[0], 1, points.shape[1])
+    for i, row in enumerate(points.tolist(), 1):
+        for j, point in enumerate(row, 1):
+            array.SetValue(i, j, gp_Pnt(*point))
+    return array
+
+def array1_to_points(array):
+    """
+    Return numpy array of points (n, 3) from TColgp_Array1OfPnt
+    """
+    return np.array([array.Value(i).Coord() for i in range(array.Lower(), array.Upper() + 1)],
+                    dtype=np.float64).reshape(-1, 3)
+
+def array2_to_points(array):
+    """
+    Return numpy array of points (nu, nv, 3) from TColgp_Array2OfPnt
+    """
+    return np.array([[array.Value(i, j).Coord() for j in range(array.LowerCol(), array.UpperCol() + 1)]
+                     for i in range(array.LowerRow(), array.UpperRow() + 1)],
+                    dtype=np.float64).reshape(array.ColLength(), array.RowLength(), 3)
+
+def reals_to_array1(values):
+    """
+    Create TColStd_Array1OfReal from numpy array (knots, weights of curve)
+    """
+    values = np.asarray(values, dtype=np.float64)
+    array = TColStd_Array1OfReal(1, len(values))
+    for index, value in enumerate(values.tolist(), 1):
+        array.SetValue(index, value)
+    return array
+
+def integers_to_array1(values):
+    """
+    Create TColStd_Array1OfInteger from numpy array (multiplicities)
+    """
+    values = np.asarray(values, dtype=int)
+    array = TColStd_Array1OfInteger(1, len(values))
+    for index, value in enumerate(values.tolist(), 1):
+        array.SetValue(index, value)
+    return array
+
+def reals_to_array2(values):
+    """
+    Create TColStd_Array2OfReal from numpy array (weights of surface)
+    """
+    values = np.asarray(values, dtype=np.float64)
+    array = TColStd_Array2OfReal(1, values.shape[0], 1, values.shape[1])
+    for i, row in enumerate(values.tolist(), 1):
+        for j, value in enumerate(row, 1):
+            array.SetValue(i, j, value)
+    return array
+
+def array1_to_numpy(array, dtype=np.float64):
+    """
+    Return numpy array from TColStd_Array1OfReal or TColStd_Array1OfInteger
+    """
+    return np.array([array.Value(i) for i in range(array.Lower(), array.Upper() + 1)], dtype=dtype)
+
+def array2_to_numpy(array, dtype=np.float64):
+    """
+    Return numpy array from TColStd_Array2OfReal
+    """
+    return np.array([[array.Value(i, j) for j in range(array.LowerCol(), array.UpperCol() + 1)]
+                     for i in range(array.LowerRow(), array.UpperRow() + 1)],
+                    dtype=dtype).reshape(array.ColLength(), array.RowLength())
+
+def indexed_points_to_numpy(points):
+    """
+    Return numpy array (max_i, max_j, 3) from dictionary of points, where
+    keys are tuples (i, j) of indexes starting from 1
+    """
+    indexes = np.array(list(points.keys()), dtype=int).reshape(-1, 2)
+    array = np.zeros(tuple(indexes.max(axis=0)) + (3,))
+    array[indexes[:, 0] - 1, indexes[:, 1] - 1] = list(points.values())
+    return array
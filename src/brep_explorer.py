@@ -3,7 +3,8 @@ from OCC.BRepTools import breptools_Read
 from OCC.TopoDS import TopoDS_Shape
 from OCC.BRep import BRep_Builder
 
-from OCC.TopExp import TopExp_Explorer
+from OCC.TopExp import TopExp_Explorer, topexp_MapShapes
+from OCC.TopTools import TopTools_IndexedMapOfShape
 
 from OCC.TopAbs import TopAbs_COMPOUND
 from OCC.TopAbs import TopAbs_COMPSOLID
@@ -135,6 +136,43 @@ def create_shape_stat(base_shape):
     return shape_stats
 
 
+def create_shape_counts(base_shape):
+    """
+    This function create statistics of shapes count like create_shape_stat,
+    but only numbers of unique shapes and of all occurences are computed.
+    Unique shapes of all types are collected by one indexed map (only they
+    are converted to python objects to get their type) and explorers only
+    move over occurences.
+    """
+    SHAPE_TYPES = (
+        TopAbs_COMPSOLID,
+        TopAbs_SOLID,
+        TopAbs_SHELL,
+        TopAbs_FACE,
+        TopAbs_WIRE,
+        TopAbs_EDGE,
+        TopAbs_VERTEX,
+        TopAbs_SHAPE
+    )
+
+    unique_counters = dict.fromkeys(SHAPE_NAMES, 0)
+    shape_map = TopTools_IndexedMapOfShape()
+    topexp_MapShapes(base_shape, shape_map)
+    for index in range(1, shape_map.Extent() + 1):
+        unique_counters[shape_map.FindKey(index).ShapeType()] += 1
+
+    shape_counts = {}
+    for shape_type in SHAPE_TYPES:
+        counter = 0
+        explorer = TopExp_Explorer(base_shape, shape_type)
+        while explorer.More():
+            counter += 1
+            explorer.Next()
+        shape_counts[shape_type] = (unique_counters[shape_type], counter)
+
+    return shape_counts
+
+
 def shape_disassembly(base_shape, shape_primitives=None):
     """
     This function tries to disable shape to list of basic components
@@ -194,6 +232,14 @@ def print_stat(base_shape_stats):
         print SHAPE_NAMES[shape_type], ":", len(shape_type_stat), "x", counter
 
 
+def print_counts(base_shape_counts):
+    """
+    This function print statistics created by create_shape_counts
+    """
+    for shape_type,(unique_count, counter) in base_shape_counts.items():
+        print SHAPE_NAMES[shape_type], ":", unique_count, "x", counter
+
+
 def main(filename, display_shape=False):
     """
     Main function of this module
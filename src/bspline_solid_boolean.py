@@ -714,8 +714,8 @@ def print_statistics(name, shape):
     Print statistics about shape
     """
     print(name)
-    stat = brep_explorer.create_shape_stat(shape)
-    brep_explorer.print_stat(stat)
+    counts = brep_explorer.create_shape_counts(shape)
+    brep_explorer.print_counts(counts)
 
 
 def solid_compound(filename=None):
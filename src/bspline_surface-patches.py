@@ -16,19 +16,9 @@ from OCC.BRepTools import breptools_Write
 
 import argparse
 
-display, start_display, add_menu, add_function_to_menu = init_display()
-
+from array_utils import indexed_points_to_numpy, points_to_array2
 
-def add_point_to_array(array, co, point, display_point=False):
-    """
-    This function creates OCC point (gp_Pnt) from tuple of 3D
-    coordinates and this OCC points is added then to the OCC 2D
-    array of points.
-    """
-    gp_point = gp_Pnt(point[0], point[1], point[2])
-    if display_point is True:
-        display.DisplayShape(gp_point, update=False)
-    array.SetValue(co[0], co[1], gp_point)    
+display, start_display, add_menu, add_function_to_menu = init_display()
 
 
 def max_indexes(keys):
@@ -56,12 +46,10 @@ def create_bspline_surfaces(patches):
     bezierarray = TColGeom_Array2OfBezierSurface(1, max_patch_i, 1, max_patch_j)
 
     for patch_id, patch in patches.items():
-        # Create OCC 'array' of control points
-        max_point_i, max_point_j = max_indexes( patch.keys() )
-        array = TColgp_Array2OfPnt(1, max_point_i, 1, max_point_j)
-        # Fill this 'array' of control points with coordinates 
-        for coord_id, coord3d in patch.items():
-            add_point_to_array(array, coord_id, coord3d, True)
+        # Create OCC 'array' of control points filled with coordinates
+        array = points_to_array2(indexed_points_to_numpy(patch))
+        for coord3d in patch.values():
+            display.DisplayShape(gp_Pnt(*coord3d), update=False)
         # Create Bezier surface
         bezier_surface = Geom_BezierSurface(array)
         # Add this Bezier surface to 'array' of Bezier surfaces
@@ -1,3 +1,7 @@
+import numpy as np
+
+from array_utils import points_to_array2, reals_to_array1, reals_to_array2, integers_to_array1
+
 def arquivostep(melhor, parordem, arquivosaida):
     ### BEGIN: allocating variables
     uknots = melhor[2]
@@ -9,58 +13,23 @@ def arquivostep(melhor, parordem, arquivosaida):
     k = int(parordem[0])
     l = int(parordem[1])
 
-    # Casting uknots from np.array to TColStd_Array1OfReal
+    # Casting knots and multiplicities to TColStd_Array1OfReal and TColStd_Array1OfInteger
     aux = np.unique(uknots)
-    tam = np.size(aux)
-
-    stepuknots = TColStd_Array1OfReal(0,tam-1)
-
-    for i in range(0,tam):
-        stepuknots.SetValue(i, aux[i])
+    stepuknots = reals_to_array1(aux)
+    aux = np.ones(np.size(aux), dtype=int)
+    aux[[0, -1]] = k
+    stepumults = integers_to_array1(aux)
 
-    # Defining UMults
-    stepumults = TColStd_Array1OfInteger(0,tam-1)
-
-    stepumults.SetValue(0,k)
-    stepumults.SetValue(tam-1,k)
-
-    for i in range(1,tam-1):
-        stepumults.SetValue(i,1)
-
-    # Casting vknots from np.array to TColStd_Array1OfReal
     aux = np.unique(vknots)
-    tam = np.size(aux)
-
-    stepvknots = TColStd_Array1OfReal(0,tam-1)
-
-    for i in range(0,tam):
-        stepvknots.SetValue(i, aux[i])
-
-    # Defining VMults
-    stepvmults = TColStd_Array1OfInteger(0,tam-1)
-
-    stepvmults.SetValue(0,l)
-    stepvmults.SetValue(tam-1,l)
-
-    for i in range(1,tam-1):
-        stepvmults.SetValue(i,1)
+    stepvknots = reals_to_array1(aux)
+    aux = np.ones(np.size(aux), dtype=int)
+    aux[[0, -1]] = l
+    stepvmults = integers_to_array1(aux)
 
     # np.shape(pesos) = np.shape(ptosctrl)
-    [p,q] = np.shape(pesos)
-
-    # Casting pesos from np.array to TColStd_Array2OfReal
-    steppesos = TColStd_Array2OfReal(0,p-1,0,q-1)
-
-    for j in range(0,q):
-        for i in range(0,p):
-            steppesos.SetValue(i, j, pesos[i][j])
-
-    # Casting ptosctrl from np.array to TColgp_Array2OfPnt
-    stepptosctrl = TColgp_Array2OfPnt(0,p-1,0,q-1)
-
-    for j in range(0,q):
-        for i in range(0,p):
-            stepptosctrl.SetValue(i, j, gp_Pnt(ptosctrl[i][j][0], ptosctrl[i][j][1], ptosctrl[i][j][2]))
+    # Casting pesos to TColStd_Array2OfReal and ptosctrl to TColgp_Array2OfPnt
+    steppesos = reals_to_array2(pesos)
+    stepptosctrl = points_to_array2(ptosctrl)
 
         ### END: allocating variables
 
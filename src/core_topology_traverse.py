@@ -20,15 +20,19 @@
 from __future__ import print_function
 import sys
 
+import numpy as np
+
 from OCC.BRepPrimAPI import BRepPrimAPI_MakeBox, BRepPrimAPI_MakeSphere
 from OCC.BRep import BRep_Tool
 from OCC.BRepTools import BRepTools_WireExplorer
 from OCC.TopAbs import (TopAbs_VERTEX, TopAbs_EDGE, TopAbs_FACE, TopAbs_WIRE,
                         TopAbs_SHELL, TopAbs_SOLID, TopAbs_COMPOUND,
                         TopAbs_COMPSOLID)
-from OCC.TopExp import TopExp_Explorer, topexp_MapShapesAndAncestors
+from OCC.TopExp import (TopExp_Explorer, topexp_MapShapes,
+                        topexp_MapShapesAndAncestors)
 from OCC.TopTools import (TopTools_ListOfShape,
                           TopTools_ListIteratorOfListOfShape,
+                          TopTools_IndexedMapOfShape,
                           TopTools_IndexedDataMapOfShapeListOfShape)
 from OCC.TopoDS import (topods, TopoDS_Wire, TopoDS_Vertex, TopoDS_Edge,
                         TopoDS_Face, TopoDS_Shell, TopoDS_Solid,
@@ -55,7 +59,7 @@ class WireExplorer(object):
             self._reinitialize()
         topologyType = topods_Edge if edges else topods_Vertex
         seq = []
-        hashes = []  # list that stores hashes to avoid redundancy
+        hashes = set()  # set that stores hashes to avoid redundancy
         occ_seq = TopTools_ListOfShape()
         while self.wire_explorer.More():
             # loop edges
@@ -66,7 +70,7 @@ class WireExplorer(object):
                 current_item = self.wire_explorer.CurrentVertex()
             current_item_hash = current_item.__hash__()
             if not current_item_hash in hashes:
-                hashes.append(current_item_hash)
+                hashes.add(current_item_hash)
                 occ_seq.Append(current_item)
             self.wire_explorer.Next()
 
@@ -91,7 +95,7 @@ class Topo(object):
     Topology traversal
     '''
 
-    def __init__(self, myShape, ignore_orientation=False):
+    def __init__(self, myShape, ignore_orientation=False, lazy=False, unique=True):
         """
 
         implements topology traversal from any TopoDS_Shape
@@ -118,9 +122,22 @@ class Topo(object):
 
         for further reference see TopoDS_Shape IsEqual / IsSame methods
 
+        :param lazy: traversal methods return generators yielding entities
+        while the shape is explored, no list of all entities is created,
+        so loops can stop early without exploring the whole shape
+
+        :param unique: generators of lazy traversal skip entities already
+        yielded, with unique=False every occurence found by the explorer
+        is yielded (24 edges and 48 vertices of a cube)
+
         """
         self.myShape = myShape
         self.ignore_orientation = ignore_orientation
+        self.lazy = lazy
+        self.unique = unique
+        # maps of ancestors built by topexp_MapShapesAndAncestors
+        # for (topoTypeA, topoTypeB), see _ancestors_map
+        self._ancestors_maps = {}
 
         # the topoFactory dicts maps topology types and functions that can
         # create this topology
@@ -152,6 +169,8 @@ class Topo(object):
                      TopAbs_COMPSOLID: TopoDS_CompSolid}
 
         assert topologyType in topoTypes.keys(), '%s not one of %s' % (topologyType, topoTypes.keys())
+        if self.lazy:
+            return self._iter_topo(topologyType, topologicalEntity, topologyTypeToAvoid, self.unique)
         self.topExp = TopExp_Explorer()
         # use self.myShape if nothing is specified
         if topologicalEntity is None and topologyTypeToAvoid is None:
@@ -165,14 +184,14 @@ class Topo(object):
                              topologyType,
                              topologyTypeToAvoid)
         seq = []
-        hashes = []  # list that stores hashes to avoid redundancy
+        hashes = set()  # set that stores hashes to avoid redundancy
         occ_seq = TopTools_ListOfShape()
         while self.topExp.More():
             current_item = self.topExp.Current()
             current_item_hash = current_item.__hash__()
 
             if not current_item_hash in hashes:
-                hashes.append(current_item_hash)
+                hashes.add(current_item_hash)
                 occ_seq.Append(current_item)
 
             self.topExp.Next()
@@ -187,18 +206,62 @@ class Topo(object):
             # filter out those entities that share the same TShape
             # but do *not* share the same orientation
             filter_orientation_seq = []
+            same_buckets = {}
             for i in seq:
-                _present = False
-                for j in filter_orientation_seq:
-                    if i.IsSame(j):
-                        _present = True
-                        break
-                if _present is False:
+                if self._is_new_same(i, same_buckets):
                     filter_orientation_seq.append(i)
-            return filter_orientation_seq
+            return iter(filter_orientation_seq)
         else:
             return iter(seq)
 
+    def _iter_topo(self, topologyType, topologicalEntity=None, topologyTypeToAvoid=None, unique=True):
+        '''
+        generator yielding entities of topologyType as the explorer
+        advances, each generator has its own explorer, so generators
+        can be nested
+        @param topologyType:
+        @param topologicalEntity: explored shape (self.myShape by default)
+        @param topologyTypeToAvoid:
+        @param unique: skip entities already yielded
+        '''
+        explorer = TopExp_Explorer()
+        if topologicalEntity is None:
+            topologicalEntity = self.myShape
+        if topologyTypeToAvoid is None:
+            explorer.Init(topologicalEntity, topologyType)
+        else:
+            explorer.Init(topologicalEntity, topologyType, topologyTypeToAvoid)
+        hashes = set()
+        same_buckets = {}
+        while explorer.More():
+            current_item = explorer.Current()
+            explorer.Next()
+            if unique:
+                current_item_hash = current_item.__hash__()
+                if current_item_hash in hashes:
+                    continue
+                hashes.add(current_item_hash)
+            topo_entity = self.topoFactory[topologyType](current_item)
+            if self.ignore_orientation and not self._is_new_same(topo_entity, same_buckets):
+                continue
+            yield topo_entity
+
+    def _is_new_same(self, topo_entity, same_buckets):
+        '''
+        returns True when no entity in same_buckets IsSame as topo_entity
+        and adds topo_entity to same_buckets
+        entities sharing the same TShape have the same hash, so IsSame
+        is only tested against entities with equal hash
+        @param topo_entity:
+        @param same_buckets: dict mapping hash to list of entities
+        '''
+        bucket = same_buckets.setdefault(topo_entity.__hash__(), [])
+        for i in bucket:
+            if i.IsSame(topo_entity):
+                return False
+        bucket.append(topo_entity)
+        return True
+
     def faces(self):
         '''
         loops over all faces
@@ -211,8 +274,35 @@ class Topo(object):
             n += 1
         return n
 
+    def _count_topo(self, topologyType, topologicalEntity=None):
+        '''
+        returns number of unique entities of topologyType without creating
+        python objects of entities, entities are collected by
+        topexp_MapShapes to indexed map, which merges entities sharing
+        the same TShape (like hashes in _loop_topo)
+        @param topologyType:
+        @param topologicalEntity: counted shape (self.myShape by default)
+        '''
+        if topologicalEntity is None:
+            topologicalEntity = self.myShape
+        _map = TopTools_IndexedMapOfShape()
+        topexp_MapShapes(topologicalEntity, topologyType, _map)
+        return _map.Extent()
+
+    def number_of_topo_types(self):
+        '''
+        returns dictionary with numbers of unique entities of all types
+        collected by one sweep over the shape
+        '''
+        counts = dict((topologyType, 0) for topologyType in self.topoFactory.keys())
+        _map = TopTools_IndexedMapOfShape()
+        topexp_MapShapes(self.myShape, _map)
+        for i in range(1, _map.Extent() + 1):
+            counts[_map.FindKey(i).ShapeType()] += 1
+        return counts
+
     def number_of_faces(self):
-        return self._number_of_topo(self.faces())
+        return self._count_topo(TopAbs_FACE)
 
     def vertices(self):
         '''
@@ -221,7 +311,7 @@ class Topo(object):
         return self._loop_topo(TopAbs_VERTEX)
 
     def number_of_vertices(self):
-        return self._number_of_topo(self.vertices())
+        return self._count_topo(TopAbs_VERTEX)
 
     def edges(self):
         '''
@@ -230,7 +320,7 @@ class Topo(object):
         return self._loop_topo(TopAbs_EDGE)
 
     def number_of_edges(self):
-        return self._number_of_topo(self.edges())
+        return self._count_topo(TopAbs_EDGE)
 
     def wires(self):
         '''
@@ -239,7 +329,7 @@ class Topo(object):
         return self._loop_topo(TopAbs_WIRE)
 
     def number_of_wires(self):
-        return self._number_of_topo(self.wires())
+        return self._count_topo(TopAbs_WIRE)
 
     def shells(self):
         '''
@@ -248,7 +338,7 @@ class Topo(object):
         return self._loop_topo(TopAbs_SHELL, None)
 
     def number_of_shells(self):
-        return self._number_of_topo(self.shells())
+        return self._count_topo(TopAbs_SHELL)
 
     def solids(self):
         '''
@@ -257,7 +347,7 @@ class Topo(object):
         return self._loop_topo(TopAbs_SOLID, None)
 
     def number_of_solids(self):
-        return self._number_of_topo(self.solids())
+        return self._count_topo(TopAbs_SOLID)
 
     def comp_solids(self):
         '''
@@ -266,7 +356,7 @@ class Topo(object):
         return self._loop_topo(TopAbs_COMPSOLID)
 
     def number_of_comp_solids(self):
-        return self._number_of_topo(self.comp_solids())
+        return self._count_topo(TopAbs_COMPSOLID)
 
     def compounds(self):
         '''
@@ -275,7 +365,7 @@ class Topo(object):
         return self._loop_topo(TopAbs_COMPOUND)
 
     def number_of_compounds(self):
-        return self._number_of_topo(self.compounds())
+        return self._count_topo(TopAbs_COMPOUND)
 
     def ordered_vertices_from_wire(self, wire):
         '''
@@ -297,6 +387,64 @@ class Topo(object):
     def number_of_ordered_edges_from_wire(self, wire):
         return self._number_of_topo(self.ordered_edges_from_wire(wire))
 
+    def _ancestors_map(self, topoTypeA, topoTypeB):
+        '''
+        returns map of all entities of topoTypeA in self.myShape to lists
+        of their ancestors of topoTypeB
+        the map is built once, when it is needed for the first time, and
+        it is reused by all following queries (self.myShape must not be
+        modified)
+        @param topoTypeA:
+        @param topoTypeB:
+        '''
+        try:
+            return self._ancestors_maps[(topoTypeA, topoTypeB)]
+        except KeyError:
+            _map = TopTools_IndexedDataMapOfShapeListOfShape()
+            topexp_MapShapesAndAncestors(self.myShape, topoTypeA, topoTypeB, _map)
+            self._ancestors_maps[(topoTypeA, topoTypeB)] = _map
+            return _map
+
+    def to_graph(self):
+        '''
+        returns incidence graph of solid -> shell -> face -> wire -> edge
+        -> vertex as tuple (maps, graph)
+
+        maps is dictionary mapping topology type to TopTools_IndexedMapOfShape
+        of all unique entities of this type, entity with index i in graph
+        is maps[type].FindKey(i + 1)
+
+        graph is dictionary mapping pairs (parent type, child type) to
+        numpy arrays (indptr, indices) in CSR format: children of parent i
+        are indices[indptr[i]:indptr[i + 1]], incidence matrix can be
+        created by scipy.sparse.csr_matrix((data, indices, indptr))
+        '''
+        topoTypes = (TopAbs_SOLID, TopAbs_SHELL, TopAbs_FACE,
+                     TopAbs_WIRE, TopAbs_EDGE, TopAbs_VERTEX)
+        maps = {}
+        for topologyType in topoTypes:
+            maps[topologyType] = TopTools_IndexedMapOfShape()
+            topexp_MapShapes(self.myShape, topologyType, maps[topologyType])
+        graph = {}
+        for parentType, childType in zip(topoTypes[:-1], topoTypes[1:]):
+            parent_map = maps[parentType]
+            child_map = maps[childType]
+            indptr = np.zeros(parent_map.Extent() + 1, dtype=np.int64)
+            indices = []
+            for i in range(1, parent_map.Extent() + 1):
+                explorer = TopExp_Explorer(parent_map.FindKey(i), childType)
+                children = set()
+                while explorer.More():
+                    # children with different orientation have same index
+                    index = child_map.FindIndex(explorer.Current()) - 1
+                    if index not in children:
+                        children.add(index)
+                        indices.append(index)
+                    explorer.Next()
+                indptr[i] = len(indices)
+            graph[(parentType, childType)] = (indptr, np.array(indices, dtype=np.int64))
+        return maps, graph
+
     def _map_shapes_and_ancestors(self, topoTypeA, topoTypeB, topologicalEntity):
         '''
         using the same method
@@ -305,8 +453,8 @@ class Topo(object):
         @param topologicalEntity:
         '''
         topo_set = set()
-        _map = TopTools_IndexedDataMapOfShapeListOfShape()
-        topexp_MapShapesAndAncestors(self.myShape, topoTypeA, topoTypeB, _map)
+        same_buckets = {}
+        _map = self._ancestors_map(topoTypeA, topoTypeB)
         results = _map.FindFromKey(topologicalEntity)
         if results.IsEmpty():
             yield None
@@ -320,12 +468,7 @@ class Topo(object):
             # to assure we're not returning entities several times
             if not topo_entity in topo_set:
                 if self.ignore_orientation:
-                    unique = True
-                    for i in topo_set:
-                        if i.IsSame(topo_entity):
-                            unique = False
-                            break
-                    if unique:
+                    if self._is_new_same(topo_entity, same_buckets):
                         yield topo_entity
                 else:
                     yield topo_entity
@@ -343,8 +486,7 @@ class Topo(object):
         @param topologicalEntity:
         '''
         topo_set = set()
-        _map = TopTools_IndexedDataMapOfShapeListOfShape()
-        topexp_MapShapesAndAncestors(self.myShape, topoTypeA, topoTypeB, _map)
+        _map = self._ancestors_map(topoTypeA, topoTypeB)
         results = _map.FindFromKey(topologicalEntity)
         if results.IsEmpty():
             return None
@@ -382,10 +524,7 @@ class Topo(object):
         return self._loop_topo(TopAbs_EDGE, face)
 
     def number_of_edges_from_face(self, face):
-        cnt = 0
-        for i in self._loop_topo(TopAbs_EDGE, face):
-            cnt += 1
-        return cnt
+        return self._count_topo(TopAbs_EDGE, face)
 
     # ======================================================================
     # VERTEX <-> EDGE
@@ -394,10 +533,7 @@ class Topo(object):
         return self._loop_topo(TopAbs_VERTEX, edg)
 
     def number_of_vertices_from_edge(self, edg):
-        cnt = 0
-        for i in self._loop_topo(TopAbs_VERTEX, edg):
-            cnt += 1
-        return cnt
+        return self._count_topo(TopAbs_VERTEX, edg)
 
     def edges_from_vertex(self, vertex):
         return self._map_shapes_and_ancestors(TopAbs_VERTEX, TopAbs_EDGE, vertex)
@@ -412,10 +548,7 @@ class Topo(object):
         return self._loop_topo(TopAbs_EDGE, wire)
 
     def number_of_edges_from_wire(self, wire):
-        cnt = 0
-        for i in self._loop_topo(TopAbs_EDGE, wire):
-            cnt += 1
-        return cnt
+        return self._count_topo(TopAbs_EDGE, wire)
 
     def wires_from_edge(self, edg):
         return self._map_shapes_and_ancestors(TopAbs_EDGE, TopAbs_WIRE, edg)
@@ -433,10 +566,7 @@ class Topo(object):
         return self._loop_topo(TopAbs_WIRE, face)
 
     def number_of_wires_from_face(self, face):
-        cnt = 0
-        for i in self._loop_topo(TopAbs_WIRE, face):
-            cnt += 1
-        return cnt
+        return self._count_topo(TopAbs_WIRE, face)
 
     def faces_from_wire(self, wire):
         return self._map_shapes_and_ancestors(TopAbs_WIRE, TopAbs_FACE, wire)
@@ -457,10 +587,7 @@ class Topo(object):
         return self._loop_topo(TopAbs_VERTEX, face)
 
     def number_of_vertices_from_face(self, face):
-        cnt = 0
-        for i in self._loop_topo(TopAbs_VERTEX, face):
-            cnt += 1
-        return cnt
+        return self._count_topo(TopAbs_VERTEX, face)
 
     # ======================================================================
     # FACE <-> SOLID
@@ -475,10 +602,7 @@ class Topo(object):
         return self._loop_topo(TopAbs_FACE, solid)
 
     def number_of_faces_from_solids(self, solid):
-        cnt = 0
-        for i in self._loop_topo(TopAbs_FACE, solid):
-            cnt += 1
-        return cnt
+        return self._count_topo(TopAbs_FACE, solid)
 
 
 def dumpTopology(shape, level=0):
@@ -635,6 +759,70 @@ def test_wire_face():
     assert(len(wires_from_face) == topo.number_of_wires_from_face(face))
 
 
+def test_ancestors_map_cache():
+    '''ancestors map is built once for each pair of types'''
+    topo_cache = Topo(get_test_box_shape())
+    for edg in topo_cache.edges():
+        assert(len(list(topo_cache.faces_from_edge(edg))) == 2)
+        assert(topo_cache.number_of_faces_from_edge(edg) == 2)
+    assert(list(topo_cache._ancestors_maps.keys()) == [(TopAbs_EDGE, TopAbs_FACE)])
+
+
+def test_number_of_topo_types():
+    '''counts of one sweep match counts of each type'''
+    counts = topo.number_of_topo_types()
+    assert(counts[TopAbs_FACE] == topo.number_of_faces() == 6)
+    assert(counts[TopAbs_EDGE] == topo.number_of_edges() == 12)
+    assert(counts[TopAbs_VERTEX] == topo.number_of_vertices() == 8)
+    assert(counts[TopAbs_WIRE] == topo.number_of_wires() == 6)
+    assert(counts[TopAbs_SHELL] == topo.number_of_shells() == 1)
+    assert(counts[TopAbs_SOLID] == topo.number_of_solids() == 1)
+    assert(counts[TopAbs_COMPOUND] == topo.number_of_compounds() == 0)
+
+
+def test_to_graph():
+    '''incidence graph of the box'''
+    maps, graph = topo.to_graph()
+    assert(maps[TopAbs_FACE].Extent() == 6)
+    indptr, indices = graph[(TopAbs_FACE, TopAbs_WIRE)]
+    assert(list(np.diff(indptr)) == [1] * 6)
+    indptr, indices = graph[(TopAbs_WIRE, TopAbs_EDGE)]
+    assert(list(np.diff(indptr)) == [4] * 6)
+    # each edge of the box is shared by two faces
+    assert(list(np.bincount(indices, minlength=12)) == [2] * 12)
+    indptr, indices = graph[(TopAbs_EDGE, TopAbs_VERTEX)]
+    assert(list(np.diff(indptr)) == [2] * 12)
+    assert(list(np.bincount(indices, minlength=8)) == [3] * 8)
+
+
+def test_lazy_traversal():
+    '''generators of lazy Topo give the same entities'''
+    topo_lazy = Topo(get_test_box_shape(), lazy=True)
+    assert(topo_lazy.number_of_faces() == 6)
+    assert(topo_lazy.number_of_edges() == 12)
+    assert(topo_lazy.number_of_vertices() == 8)
+    face = next(topo_lazy.faces())
+    assert(isinstance(face, TopoDS_Face))
+    assert(topo_lazy.number_of_edges_from_face(face) == 4)
+    for f in topo_lazy.faces():
+        for e in topo_lazy.edges_from_face(f):
+            assert isinstance(e, TopoDS_Edge)
+    topo_all = Topo(get_test_box_shape(), lazy=True, unique=False)
+    assert(len(list(topo_all.faces())) == 6)
+    assert(len(list(topo_all.edges())) == 24)
+    assert(len(list(topo_all.vertices())) == 48)
+
+
+def test_ignore_orientation():
+    '''entities of same TShape are returned once'''
+    topo_same = Topo(get_test_box_shape(), ignore_orientation=True)
+    assert(len(list(topo_same.faces())) == 6)
+    assert(len(list(topo_same.edges())) == 12)
+    assert(len(list(topo_same.vertices())) == 8)
+    edg = next(topo_same.edges())
+    assert(len(list(topo_same.faces_from_edge(edg))) == 2)
+
+
 def test_edges_out_of_scope():
     # check pointers going out of scope
     face = next(topo.faces())
@@ -669,5 +857,11 @@ if __name__ == "__main__":
     test_nested_iteration()
     test_loop_edges()
     test_loop_faces()
+    test_ignore_orientation()
+    test_ancestors_map_cache()
+    test_lazy_traversal()
+    number_of_topological_entities()
+    test_number_of_topo_types()
+    test_to_graph()
     test_edges_out_of_scope()
     test_wires_out_of_scope()
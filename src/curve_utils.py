@@ -0,0 +1,260 @@
+"""
+Utilities for aproximation of polylines (rivers, borders) with cubic curves
+"""
+
+import numpy as np
+from scipy import interpolate
+
+def compute_points_params(x, y, z=None):
+    """
+    This function return vector t with parametrisation of points
+    """
+    # Compute distances of Points from begining of curve
+    if z is None:
+        dist = np.hypot(np.diff(x), np.diff(y))
+    else:
+        dist = np.hypot(np.hypot(np.diff(x), np.diff(y)), np.diff(z))
+    d = np.concatenate(([0.0], np.cumsum(dist)))
+
+    # Computer values of parameter t mapping t_{i} to point P_{i}
+    return d / d[-1]
+
+def compute_points_params_batch(points, offsets):
+    """
+    Compute parametrisation of many polylines at once. Points of all
+    polylines are stored in one (n, dim) array, points of polyline k are
+    points[offsets[k]:offsets[k + 1]]. Return vector t of parameters of
+    all points.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    offsets = np.asarray(offsets)
+    diff = np.diff(points, axis=0)
+    dist = np.concatenate(([0.0], np.sqrt(np.einsum('ij,ij->i', diff, diff))))
+    # First point of each polyline starts from zero
+    dist[offsets[:-1]] = 0.0
+    d = np.cumsum(dist)
+    counts = np.diff(offsets)
+    start = d[offsets[:-1]]
+    length = d[offsets[1:] - 1] - start
+    return (d - np.repeat(start, counts)) / np.repeat(length, counts)
+
+def construct_param_matrix(t):
+    """
+    Construct matrix of parametrisation for least square solution
+    """
+    return np.mat(np.vander(t, 4))
+
+# Base matrix of Bezier cubic curve
+BEZIER_MATRIX = np.array([
+    [-1.0, 3.0, -3.0, 1.0],
+    [3.0, -6.0, 3.0, 0.0],
+    [-3.0, 3.0, 0.0, 0.0],
+    [1.0, 0.0, 0.0, 0.0]])
+
+def fit_bezier_curves(points, offsets):
+    """
+    Aproximate each polyline (see compute_points_params_batch) with cubic
+    Bezier curve by least squares. Design matrix of Bezier basis is built
+    for all points at once and all coordinates of a polyline are solved by
+    one call of lstsq (no normal equations, no explicit inversion).
+    Return tuple (control points (count, 4, dim), parameters of points,
+    max errors, rms errors), where errors are distances of points from
+    the curve.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    offsets = np.asarray(offsets)
+    t = compute_points_params_batch(points, offsets)
+    B = np.dot(np.vander(t, 4), BEZIER_MATRIX)
+    control_points = np.empty((len(offsets) - 1, 4, points.shape[1]))
+    for index in range(len(offsets) - 1):
+        rows = slice(offsets[index], offsets[index + 1])
+        control_points[index] = np.linalg.lstsq(B[rows], points[rows], rcond=None)[0]
+    # Distances of points from curve at their parameters
+    polyline = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    fitted = np.einsum('ij,ijk->ik', B, control_points[polyline])
+    errors = np.sqrt(np.sum((points - fitted)**2, axis=1))
+    max_errors = np.maximum.reduceat(errors, offsets[:-1])
+    rms_errors = np.sqrt(np.add.reduceat(errors**2, offsets[:-1]) / np.diff(offsets))
+    return control_points, t, max_errors, rms_errors
+
+def bspline_basis(x, t, k=3):
+    """
+    Return matrix (len(x), len(t) - k - 1) of values of all b-spline basis
+    functions of degree k with knot vector t in points x
+    """
+    return interpolate.BSpline(t, np.eye(len(t) - k - 1), k)(x)
+
+def fit_piecewise_bezier(points, tolerance):
+    """
+    Aproximate polyline with cubic C2 b-spline curve going through the first
+    and the last point. Poles are computed by one least squares solution
+    and knot is inserted to the middle of points of the knot span with the
+    worst aproximated point, until distance of all points from the curve
+    is at most tolerance (or no such span can be split). Return b-spline
+    representation (poles, knots, multiplicities) of the curve; degree is
+    3 and knots are proportional to length of polyline.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    if len(points) < 4:
+        # Not enough points for inner poles, use straight line
+        poles = np.array([points[0], (2.0 * points[0] + points[-1]) / 3.0,
+                          (points[0] + 2.0 * points[-1]) / 3.0, points[-1]])
+        return poles, np.array([0.0, 1.0]), np.array([4, 4])
+    u = compute_points_params_batch(points, [0, len(points)])
+    knots = np.array([0.0, 1.0])
+    result = None
+    # Knot spans, which can not be split
+    blocked = set()
+    while True:
+        B = bspline_basis(u, np.concatenate(([0.0] * 3, knots, [1.0] * 3)))
+        poles = np.empty((B.shape[1], points.shape[1]))
+        poles[0] = points[0]
+        poles[-1] = points[-1]
+        rhs = points - np.outer(B[:, 0], points[0]) - np.outer(B[:, -1], points[-1])
+        poles[1:-1], residues, rank, singular = np.linalg.lstsq(B[:, 1:-1], rhs, rcond=None)
+        if result is not None and rank < len(poles) - 2:
+            # Poles of the last split span are not determined by points
+            blocked.add(split_span)
+            knots = result[1]
+            continue
+        result = (poles, knots)
+        errors = np.sqrt(np.sum((points - np.dot(B, poles))**2, axis=1))
+        # Knot span of each point and the worst error of spans with inner
+        # points, which can be split
+        span = np.minimum(np.searchsorted(knots, u, side='right') - 1, len(knots) - 2)
+        inner = u > knots[span]
+        span_errors = np.zeros(len(knots) - 1)
+        np.maximum.at(span_errors, span, errors)
+        span_errors[np.bincount(span[inner], minlength=len(knots) - 1) < 1] = 0.0
+        for index in range(len(knots) - 1):
+            if (knots[index], knots[index + 1]) in blocked:
+                span_errors[index] = 0.0
+        split = int(np.argmax(span_errors))
+        if span_errors[split] <= tolerance:
+            break
+        split_span = (knots[split], knots[split + 1])
+        knots = np.insert(knots, split + 1, np.median(u[inner & (span == split)]))
+    poles, knots = result
+    mults = np.array([4] + [1] * (len(knots) - 2) + [4])
+    return poles, knots, mults
+
+def make_bspline_curve(poles, knots, mults, degree=3):
+    """
+    Create OCC Geom_BSplineCurve (handle) from numpy arrays of poles (n, 3),
+    knots and multiplicities
+    """
+    from OCC.Geom import Geom_BSplineCurve
+    from array_utils import points_to_array1, reals_to_array1, integers_to_array1
+    occ_poles = points_to_array1(poles)
+    occ_knots = reals_to_array1(knots)
+    occ_mults = integers_to_array1(mults)
+    return Geom_BSplineCurve(occ_poles, occ_knots, occ_mults, degree).GetHandle()
+
+def bezier_param_matrix(t, derivative=0):
+    """
+    Return matrix (len(t), 4) of powers of parameters t (or their
+    derivatives) of cubic curve
+    """
+    t = np.asarray(t, dtype=np.float64)
+    zeros = np.zeros(t.shape)
+    ones = np.ones(t.shape)
+    if derivative == 0:
+        return np.vander(t, 4)
+    elif derivative == 1:
+        return np.column_stack((3.0 * t**2, 2.0 * t, ones, zeros))
+    elif derivative == 2:
+        return np.column_stack((6.0 * t, 2.0 * ones, zeros, zeros))
+    elif derivative == 3:
+        return np.column_stack((6.0 * ones, zeros, zeros, zeros))
+    return np.zeros((t.size, 4))
+
+def evaluate_bezier(control_points, t, derivative=0):
+    """
+    Evaluate cubic Bezier curve given by control points (4, dim) in all
+    parameters t by one matrix product. Return array (len(t), dim) of
+    points or their derivatives.
+    """
+    control_points = np.asarray(control_points, dtype=np.float64)
+    return np.dot(np.dot(bezier_param_matrix(t, derivative), BEZIER_MATRIX), control_points)
+
+def evaluate_piecewise_bezier(poles, knots, mults, u, derivative=0):
+    """
+    Evaluate cubic b-spline curve created by fit_piecewise_bezier in
+    parameters u. Return array (len(u), dim) of points or their derivatives.
+    """
+    u = np.asarray(u, dtype=np.float64)
+    curve = interpolate.BSpline(np.repeat(knots, mults), np.asarray(poles, dtype=np.float64), 3)
+    return curve(u, nu=derivative)
+
+def constant_runs_mask(values, max_run=None, eps=0.0):
+    """
+    Return mask of values (n,) or points (n, dim), which are not part of
+    constant run. Value is kept, when it differs from previous value more
+    than eps, or when it is max_run + 1 values after the last different
+    value (None means only the first value of run is kept). The first and
+    the last value are kept always.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if values.ndim == 1:
+        values = values[:, np.newaxis]
+    mask = np.ones(len(values), dtype=bool)
+    if len(values) < 3:
+        return mask
+    mask[1:] = np.any(np.abs(np.diff(values, axis=0)) > eps, axis=1)
+    if max_run is not None:
+        # Index of the first value of run for each value
+        index = np.arange(len(values))
+        start = np.maximum.accumulate(np.where(mask, index, 0))
+        mask |= (index - start) % (max_run + 1) == 0
+    mask[-1] = True
+    return mask
+
+def simplify_polyline(points, tolerance):
+    """
+    Return mask of points (n, dim) of polyline simplified by Douglas-Peucker
+    algorithm. Distance of removed points from simplified polyline is at
+    most tolerance. Recursion is replaced by stack of segments and distances
+    of all points of segment are computed at once.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    mask = np.zeros(len(points), dtype=bool)
+    mask[0] = mask[-1] = True
+    # Stack of (first, last) indexes of segments to simplify
+    stack = [(0, len(points) - 1)]
+    while len(stack) > 0:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        inner = points[first + 1:last] - points[first]
+        direction = points[last] - points[first]
+        length = np.dot(direction, direction)
+        if length > 0.0:
+            # Distance from line segment (not from line)
+            t = np.clip(np.dot(inner, direction) / length, 0.0, 1.0)
+            inner = inner - np.outer(t, direction)
+        dist = np.einsum('ij,ij->i', inner, inner)
+        index = int(np.argmax(dist))
+        if dist[index] > tolerance**2:
+            split = first + 1 + index
+            mask[split] = True
+            stack.append((split, last))
+            stack.append((first, split))
+    return mask
+
+def simplify_polylines(polylines, tolerance):
+    """
+    Remove repeated points and points not needed for representation of
+    polylines (dictionary of lists of points) with given tolerance. Return
+    dictionary of lists of remaining points.
+    """
+    simplified = {}
+    for key, polyline in polylines.items():
+        points = np.asarray(polyline, dtype=np.float64)
+        if len(points) < 3:
+            simplified[key] = list(polyline)
+            continue
+        # Only x, y coordinates of points are compared
+        indexes = np.flatnonzero(constant_runs_mask(points[:, :2]))
+        indexes = indexes[simplify_polyline(points[indexes, :2], tolerance)]
+        simplified[key] = [polyline[index] for index in indexes]
+    return simplified
@@ -4,40 +4,9 @@ import matplotlib.pyplot as plt
 import sys
 import math
 
-eps = sys.float_info.epsilon
+from curve_utils import compute_points_params, construct_param_matrix, evaluate_bezier
 
-def compute_points_params(x, y, z=None):
-    """
-    This function return vector t with parametrisation of points
-    """
-    # Compute distances of Points from begining of curve
-    di = 0.0
-    d = [di,]
-    for i in range(1, n):
-        if z is None:
-            dest = math.sqrt( (x[i] - x[i - 1])**2 + (y[i] - y[i - 1])**2 )
-        else:
-            dest = math.sqrt( (x[i] - x[i - 1])**2 + (y[i] - y[i - 1])**2 + (z[i] - z[i - 1])**2 )
-        di += dest
-        d.append(di)
-
-    # Computer values of parameter t mapping t_{i} to point P_{i}
-    t = []
-    for item in d:
-        t.append(item/d[-1])
-    t = np.array(t)
-
-    return t
-
-def construct_param_matrix(t):
-    """
-    Construct matrix of parametrisation for least square solution
-    """
-    t3 = np.array([item**3 for item in t])
-    t2 = np.array([item**2 for item in t])
-    t1 = np.array([item for item in t])
-    t0 = np.array([1 for item in t])
-    return np.mat([t3, t2, t1, t0]).transpose()
+eps = sys.float_info.epsilon
 
 # Coordinates of points P=[P_{1}, P_{2}, ..., P_{n}]
 x = np.array([0.0, 1.0, 2.0, 3.0, 4.0])
@@ -72,37 +41,24 @@ diff_xn = x[n - 1] - Cx[3]
 diff_y0 = y[0] - Cy[0]
 diff_yn = y[n - 1] - Cy[3]
 
-dy = ( diff_y0 + diff_yn ) / 2.0
+dy = ( diff_y0[0, 0] + diff_yn[0, 0] ) / 2.0
 
-Kx = np.array([x[0], Cx[1], Cx[2], x[n - 1]])
-Ky = np.array([y[0], Cy[1] - dy, Cy[2] - dy, y[n - 1]])
+Kx = np.array([x[0], Cx[1, 0], Cx[2, 0], x[n - 1]])
+Ky = np.array([y[0], Cy[1, 0] - dy, Cy[2, 0] - dy, y[n - 1]])
 
 # Draw coordinates of P points
 plt.scatter(x,y)
 
 dt = 0.02
+t = np.linspace(0.0, 1.0, int(round(1.0 / dt)) + 1)
 
 # Draw Bezier curve aproximating points
-Px = []
-Py = []
-t = 0.0
-while t < 1.0 + dt:
-    P = np.array([t**3, t**2, t, 1]) * M * np.bmat([Cx, Cy])
-    Px.append(P[0, 0])
-    Py.append(P[0, 1])
-    t += dt
-plt.plot(Px, Py, c='red')
+P = evaluate_bezier(np.hstack((Cx, Cy)), t)
+plt.plot(P[:, 0], P[:, 1], c='red')
 
 # Draw Bezier curve aproximating points and intersecting first and
 # last point
-Px = []
-Py = []
-t = 0.0
-while t < 1.0 + dt:
-    P = np.array([t**3, t**2, t, 1]) * M * np.mat([Kx, Ky]).transpose()
-    Px.append(P[0, 0])
-    Py.append(P[0, 1])
-    t += dt
-plt.plot(Px, Py, c='blue')
+P = evaluate_bezier(np.column_stack((Kx, Ky)), t)
+plt.plot(P[:, 0], P[:, 1], c='blue')
 
 plt.show()
@@ -9,40 +9,9 @@ from matplotlib import cm
 from matplotlib.ticker import LinearLocator, FormatStrFormatter
 import matplotlib.pyplot as plt
 import numpy as np
-from numpy.linalg import inv
 
-def compute_points_params(x, y, z=None):
-    """
-    This function return vector t with parametrisation of points
-    """
-    # Compute distances of Points from begining of curve
-    di = 0.0
-    d = [di,]
-    for i in range(1, len(x)):
-        if z is None:
-            dest = math.sqrt( (x[i] - x[i - 1])**2 + (y[i] - y[i - 1])**2 )
-        else:
-            dest = math.sqrt( (x[i] - x[i - 1])**2 + (y[i] - y[i - 1])**2 + (z[i] - z[i - 1])**2 )
-        di += dest
-        d.append(di)
-
-    # Computer values of parameter t mapping t_{i} to point P_{i}
-    t = []
-    for item in d:
-        t.append(item/d[-1])
-    t = np.array(t)
-
-    return t
-
-def construct_param_matrix(t):
-    """
-    Construct matrix of parametrisation for least square solution
-    """
-    t3 = np.array([item**3 for item in t])
-    t2 = np.array([item**2 for item in t])
-    t1 = np.array([item for item in t])
-    t0 = np.array([1 for item in t])
-    return np.mat([t3, t2, t1, t0]).transpose()
+from curve_utils import fit_bezier_curves, fit_piecewise_bezier, make_bspline_curve, simplify_polylines
+from terrain_cache import FitCache
 
 class River(object):
     """
@@ -52,41 +21,34 @@ class River(object):
         self.river_id = river_id
         self.data_2d = []
         self.data_3d = []
-        self.curve_params = []
+        self.curve_params = [] # Control points of Bezier curve
         self.t_params = []
+        self.fit_error = None # Max and rms distance of points from curve
+        self.bspline_params = None # Poles, knots and multiplicities of piecewise curve
 
     def curve_from_3d_data(self):
         """
+        Aproximate 3d data of river with cubic Bezier curve
         """
-        M = np.matrix([
-            [-1, 3, -3, 1],
-            [3, -6, 3, 0],
-            [-3, 3, 0, 0],
-            [1, 0, 0, 0]])
-        iM = inv(M)
-
-        rx = [item[0] for item in river]
-        ry = [item[1] for item in river]
-        rz = [item[2] for item in river]
-
-        # Compute array of t params
-        t = compute_points_params(rx, ry, rz)
-
-        # Construct matrix T
-        T = construct_param_matrix(t)
-        tT = T.transpose()
-
-        X = np.mat(rx).transpose()
-        Y = np.mat(ry).transpose()
-        Z = np.mat(rz).transpose()
+        points = np.asarray(self.data_3d, dtype=np.float64)
+        control_points, t, max_errors, rms_errors = fit_bezier_curves(points, [0, len(points)])
+        self.curve_params = control_points[0]
+        self.t_params = t
+        self.fit_error = (max_errors[0], rms_errors[0])
 
-        Cx = iM * inv(tT * T) * tT * X
-        Cy = iM * inv(tT * T) * tT * Y
-        Cz = iM * inv(tT * T) * tT * Z
+    def piecewise_curve_from_3d_data(self, tolerance):
+        """
+        Aproximate 3d data of river with piecewise cubic curve, which
+        has distance from all points at most tolerance
+        """
+        self.bspline_params = fit_piecewise_bezier(np.asarray(self.data_3d, dtype=np.float64), tolerance)
 
-        print Cx
-        print Cy
-        print Cz
+    def bspline_curve(self):
+        """
+        Return OCC Geom_BSplineCurve of piecewise curve
+        """
+        poles, knots, mults = self.bspline_params
+        return make_bspline_curve(poles, knots, mults, 3)
 
 class TerrainData(object):
     """
@@ -215,12 +177,31 @@ class TerrainData(object):
                 # Only one border ATM
                 self.area_borders_2d[0].append( tuple( float(item) for item in items[1:]) )
 
+    def simplify_2d_polylines(self, tolerance):
+        """
+        Remove points of rivers and area borders, which are not needed for
+        representation of polylines with given tolerance
+        """
+        rivers_data_2d = dict((river_id, river.data_2d) for river_id, river in self.rivers.items())
+        rivers_data_2d = simplify_polylines(rivers_data_2d, tolerance)
+        for river_id, river in self.rivers.items():
+            river.data_2d = rivers_data_2d[river_id]
+        self.area_borders_2d = simplify_polylines(self.area_borders_2d, tolerance)
+
     def aproximate_terrain(self):
         """
         Try to aproximate terrain with bspline surface
         """
-
-        tck,fp,ior,msg = interpolate.bisplrep(self.tX, self.tY, self.tZ, kx=5, ky=5, full_output=1)
+        cache = None
+        if self.conf.get('cache_dir') is not None:
+            cache = FitCache(self.conf['cache_dir'], self.conf.get('cache_size', 512) * 1024 * 1024)
+            key = cache.key([self.yaml_file_name, self.conf['terrain']],
+                            ('load_points-curves.aproximate_terrain', sorted(self.conf.items())))
+            tck = cache.load(key)
+        if cache is None or tck is None:
+            tck,fp,ior,msg = interpolate.bisplrep(self.tX, self.tY, self.tZ, kx=5, ky=5, full_output=1)
+            if cache is not None:
+                cache.save(key, tck)
         self.tck[(self.min_x, self.min_y, self.max_x, self.max_y)] = tck
         # Compute difference between original terrain data and b-spline surface
         self.tW = [abs(it[2] - interpolate.bisplev(it[0], it[1], tck)) for it in self.terrain_data]
@@ -255,8 +236,8 @@ class TerrainData(object):
         Try to aproximate z coordinates of rivers using terrain data
         """
         
-        for river in self.rivers.items():
-            river.data_3d[river_id] = []
+        for river in self.rivers.values():
+            river.data_3d = []
             last_z = sys.maxsize
             for rp in river.data_2d:
                 # Compute indexes to the grid first
@@ -279,6 +260,25 @@ class TerrainData(object):
                 last_z = Z
                 river.data_3d.append( (rp[0], rp[1], Z) )
 
+    def aproximate_rivers_curves(self):
+        """
+        Try to aproximate all rivers with Bezier curves at once
+        """
+        rivers = [river for river in self.rivers.values() if len(river.data_3d) > 1]
+        if len(rivers) == 0:
+            return
+        offsets = np.cumsum([0] + [len(river.data_3d) for river in rivers])
+        points = np.concatenate([np.asarray(river.data_3d, dtype=np.float64) for river in rivers])
+        control_points, t, max_errors, rms_errors = fit_bezier_curves(points, offsets)
+        for index, river in enumerate(rivers):
+            river.curve_params = control_points[index]
+            river.t_params = t[offsets[index]:offsets[index + 1]]
+            river.fit_error = (max_errors[index], rms_errors[index])
+            print 'river: ', river.river_id, ' max error: ', max_errors[index], ' rms: ', rms_errors[index]
+            if max_errors[index] > self.conf.get('river_tolerance', 1.0):
+                # One Bezier curve is not enough
+                river.piecewise_curve_from_3d_data(self.conf.get('river_tolerance', 1.0))
+
     def display_terrain(self):
         """
         Try to display terrain
@@ -295,11 +295,11 @@ class TerrainData(object):
             terrain_points = ax.scatter(self.tX, self.tY, self.tZ)
 
         # Draw rivers
-        for river in self.rivers.items():
+        for river in self.rivers.values():
             rx = [item[0] for item in river.data_3d]
             ry = [item[1] for item in river.data_3d]
             rz = [item[2] for item in river.data_3d]
-            ax.plot(rx, ry, rz, label=str(river_id))
+            ax.plot(rx, ry, rz, label=str(river.river_id))
 
         # Draw borders
         for border_id,border in self.area_borders_3d.items():
@@ -337,10 +337,13 @@ def main(yaml_conf_filename):
     terrain_data.load_terrain()
     terrain_data.load_rivers()
     terrain_data.load_area()
+    if terrain_data.conf.get('simplify_tolerance') is not None:
+        terrain_data.simplify_2d_polylines(terrain_data.conf['simplify_tolerance'])
 
     terrain_data.aproximate_terrain()
     terrain_data.aproximate_2d_borders()
     terrain_data.aproximate_2d_rivers()
+    terrain_data.aproximate_rivers_curves()
     
     terrain_data.display_terrain()
 
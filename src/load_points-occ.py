@@ -3,11 +3,14 @@ import argparse
 import math
 import sys
 
+import numpy as np
+from scipy import interpolate
 from OCC.gp import *
 from OCC.Geom import *
 import OCC.GeomAPI
 from OCC.TColGeom import *
 from OCC.TColgp import * 
+from OCC.TColStd import TColStd_Array1OfReal, TColStd_Array1OfInteger
 from OCC.GeomConvert import *
 from OCC.BRepBuilderAPI import *
 from OCC.TopoDS import *
@@ -15,6 +18,11 @@ from OCC.STEPControl import *
 
 from OCC.Display.SimpleGui import init_display
 
+from array_utils import points_to_array2, array2_to_points, array1_to_numpy
+from curve_utils import fit_piecewise_bezier, make_bspline_curve, simplify_polylines
+from surface_utils import make_bspline_surface, tck_to_bspline_params
+from terrain_cache import FitCache
+
 class TerrainData(object):
     """
     Class representing Terrain data (terrain, rivers, aproximation, etc)
@@ -103,14 +111,14 @@ class TerrainData(object):
         self.diff_y = self.max_y - self.min_y
         self.dx = self.diff_x / float(self.size_x - 1)
         self.dy = self.diff_y / float(self.size_y - 1)
-        self.grid = {}
         #print size_x, size_y, diff_x, diff_y, dx, dy
-        self.array = TColgp_Array2OfPnt(1, self.size_x, 1, self.size_y)
-        for index in range(0, self.point_count):
-            i = int( math.floor( (self.terrain_data[index][0] - self.min_x) / self.dx ) )
-            j = int( math.floor( (self.terrain_data[index][1] - self.min_y) / self.dy ) )
-            self.grid[(i, j)] = (self.terrain_data[index][0], self.terrain_data[index][1], self.terrain_data[index][2])
-            self.array.SetValue(i + 1, j + 1, gp_Pnt(self.terrain_data[index][0], self.terrain_data[index][1], self.terrain_data[index][2]))
+        points = np.array(self.terrain_data, dtype=np.float64)
+        I = np.floor((points[:, 0] - self.min_x) / self.dx).astype(int)
+        J = np.floor((points[:, 1] - self.min_y) / self.dy).astype(int)
+        self.grid = dict(zip(zip(I.tolist(), J.tolist()), self.terrain_data))
+        grid_points = np.zeros((self.size_x, self.size_y, 3))
+        grid_points[I, J] = points
+        self.array = points_to_array2(grid_points)
 
     def load_terrain(self):
         """
@@ -147,12 +155,72 @@ class TerrainData(object):
                 # Only one border ATM
                 self.area_borders_2d[0].append( tuple( float(item) for item in items[1:]) )
 
+    def simplify_2d_polylines(self, tolerance):
+        """
+        Remove points of rivers and area borders, which are not needed for
+        representation of polylines with given tolerance
+        """
+        self.rivers_data_2d = simplify_polylines(self.rivers_data_2d, tolerance)
+        self.area_borders_2d = simplify_polylines(self.area_borders_2d, tolerance)
+
     def aproximate_terrain(self):
         """
         Try to aproximate terrain with bspline surface
         """
-        surfacer = OCC.GeomAPI.GeomAPI_PointsToBSplineSurface(self.array, 3, 8)
-        self.surface = surfacer.Surface()
+        cache = None
+        if self.conf.get('cache_dir') is not None:
+            cache = FitCache(self.conf['cache_dir'], self.conf.get('cache_size', 512) * 1024 * 1024)
+            key = cache.key([self.yaml_file_name, self.conf['terrain']],
+                            ('load_points-occ.aproximate_terrain', sorted(self.conf.items())))
+            surface_data = cache.load(key)
+            if surface_data is not None:
+                self.surface = self.__surface_from_data(surface_data)
+                return
+        if self.conf.get('fit_engine') == 'scipy':
+            # Fit surface z = f(x, y) by SciPy and convert it to OCC surface
+            # without another aproximation
+            tck = interpolate.bisplrep(self.tX, self.tY, self.tZ,
+                                       kx=self.conf.get('kx', 3), ky=self.conf.get('ky', 3))
+            surface_data = tck_to_bspline_params(tck)
+            self.surface = self.__surface_from_data(surface_data)
+        else:
+            surfacer = OCC.GeomAPI.GeomAPI_PointsToBSplineSurface(self.array, 3, 8)
+            self.surface = surfacer.Surface()
+            surface_data = self.__surface_to_data(self.surface)
+        if cache is not None:
+            cache.save(key, surface_data)
+
+    def __surface_to_data(self, surface):
+        """
+        Convert bspline surface to dictionary of poles, knots, multiplicities
+        and degrees, which can be stored in cache
+        """
+        bspline = surface.GetObject()
+        poles = TColgp_Array2OfPnt(1, bspline.NbUPoles(), 1, bspline.NbVPoles())
+        bspline.Poles(poles)
+        uknots = TColStd_Array1OfReal(1, bspline.NbUKnots())
+        bspline.UKnots(uknots)
+        vknots = TColStd_Array1OfReal(1, bspline.NbVKnots())
+        bspline.VKnots(vknots)
+        umults = TColStd_Array1OfInteger(1, bspline.NbUKnots())
+        bspline.UMultiplicities(umults)
+        vmults = TColStd_Array1OfInteger(1, bspline.NbVKnots())
+        bspline.VMultiplicities(vmults)
+        return {
+            'poles': array2_to_points(poles),
+            'uknots': array1_to_numpy(uknots),
+            'vknots': array1_to_numpy(vknots),
+            'umults': array1_to_numpy(umults, dtype=int),
+            'vmults': array1_to_numpy(vmults, dtype=int),
+            'udegree': bspline.UDegree(),
+            'vdegree': bspline.VDegree()
+        }
+
+    def __surface_from_data(self, surface_data):
+        """
+        Create bspline surface from dictionary created by __surface_to_data
+        """
+        return make_bspline_surface(**surface_data)
 
     def aproximate_2d_borders(self):
         """
@@ -206,13 +274,11 @@ class TerrainData(object):
                     Z = last_z
                 last_z = Z 
                 self.rivers_data_3d[river_id].append( (rp[0], rp[1], Z) )
-            # Use OCC to aproximate rivers with BSpline curve
-            array = TColgp_Array1OfPnt(1, len(self.rivers_data_3d[river_id]))
-            point_id = 1
-            for point in self.rivers_data_3d[river_id]:
-                array.SetValue(point_id, gp_Pnt(point[0], point[1], point[2]))
-                point_id += 1
-            self.rivers[river_id] = OCC.GeomAPI.GeomAPI_PointsToBSpline(array).Curve()
+            # Aproximate rivers with piecewise cubic BSpline curve; number
+            # of segments depends on shape of river, not on number of points
+            poles, knots, mults = fit_piecewise_bezier(np.array(self.rivers_data_3d[river_id]),
+                                                       self.conf.get('river_tolerance', 1.0))
+            self.rivers[river_id] = make_bspline_curve(poles, knots, mults, 3)
 
     def display_terrain(self):
         """
@@ -235,6 +301,8 @@ def main(yaml_conf_filename):
     terrain_data.load_terrain()
     terrain_data.load_rivers()
     terrain_data.load_area()
+    if terrain_data.conf.get('simplify_tolerance') is not None:
+        terrain_data.simplify_2d_polylines(terrain_data.conf['simplify_tolerance'])
 
     terrain_data.aproximate_terrain()
     terrain_data.aproximate_2d_borders()
@@ -1,15 +1,205 @@
 import yaml
 import argparse
+import itertools
 import math
+import multiprocessing
+import os
 import sys
+from collections import OrderedDict
+from contextlib import closing
 
-from scipy import interpolate
+from scipy import interpolate, ndimage
 from mpl_toolkits.mplot3d import Axes3D
 from matplotlib import cm
 from matplotlib.ticker import LinearLocator, FormatStrFormatter
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import matplotlib.pyplot as plt
 import numpy as np
 
+from curve_utils import simplify_polylines
+from terrain_cache import FitCache
+
+# Relative tolerance of coordinates placed on regular grid
+LATTICE_TOLERANCE = 1e-6
+# Maximal ratio of missing nodes, when terrain is still treated as grid
+MAX_MISSING_NODES = 0.5
+# Maximal distance of coordinate from lattice node in lattice spacings
+MAX_LATTICE_OFFSET = 0.1
+# Extension of binary terrain files
+BINARY_TERRAIN_SUFFIX = '.npy'
+# Number of lines of terrain file read at once in streaming mode
+STREAMING_CHUNK_SIZE = 1000000
+# Number of scattered points evaluated by one call of b-spline evaluation
+RESIDUALS_BATCH_SIZE = 1000000
+# Maximal number of terrain points displayed in streaming mode
+STREAMING_DISPLAY_POINTS = 1000000
+# Maximal number of refits of grid tile with missing nodes and relative
+# change of filled heights, when refitting stops
+MISSING_NODES_ITERATIONS = 50
+MISSING_NODES_TOLERANCE = 1e-6
+# Default number of sampled surfaces kept in memory
+SAMPLES_CACHE_SIZE = 32
+# Resolution of preview images and pixels per one drawn terrain point
+# and per one drawn cell of surface
+PREVIEW_DPI = 100
+PREVIEW_PIXELS_PER_POINT = 16
+PREVIEW_PIXELS_PER_CELL = 4
+
+def bspline_basis(x, t, k):
+    """
+    Return matrix (len(x), len(t) - k - 1) of values of all b-spline basis
+    functions of degree k with knot vector t in points x
+    """
+    n = len(t) - k - 1
+    return interpolate.BSpline(t, np.eye(n), k)(x)
+
+def fit_tile(task):
+    """
+    Aproximate points of one tile with bspline surface. Task is tuple
+    (X, Y, Z, kx, ky, knots). Returns tuple (tck, fp). Defined on module
+    level to be usable in worker processes.
+
+    When knots is None, knots are placed automatically by bisplrep
+    smoothing. Otherwise knots is tuple (TX, TY) of interior knots and
+    surface is computed by one least squares solution. When Z is 2D array
+    (len(Y), len(X)) of grid heights, X and Y are coordinates of grid
+    lines and least squares problem of tensor product surface is solved
+    as two small problems of 1D b-spline curves. Missing nodes (NaN) of grid
+    are filled by heights of nearest nodes and then repeatedly by heights
+    of fitted surface, which converges to least squares fit of defined
+    nodes, but keeps coefficients without data determined.
+    """
+    X, Y, Z, kx, ky, knots = task
+    if knots is None:
+        tck,fp,ior,msg = interpolate.bisplrep(X, Y, Z, kx=kx, ky=ky, full_output=1)
+        return tck, fp
+    TX, TY = knots
+    if Z.ndim == 1:
+        # Georeferenced coordinates are too big for rank test of FITPACK
+        x0, y0 = X.min(), Y.min()
+        spline = interpolate.LSQBivariateSpline(X - x0, Y - y0, Z, TX - x0, TY - y0, kx=kx, ky=ky)
+        tx, ty, c = spline.tck
+        return [tx + x0, ty + y0, c, kx, ky], spline.get_residual()
+    tx = np.concatenate(([X[0]] * (kx + 1), TX, [X[-1]] * (kx + 1)))
+    ty = np.concatenate(([Y[0]] * (ky + 1), TY, [Y[-1]] * (ky + 1)))
+    BX = bspline_basis(X, tx, kx)
+    BY = bspline_basis(Y, ty, ky)
+    missing = np.isnan(Z)
+    Z = np.array(Z)
+    if missing.any():
+        XG, YG = np.meshgrid(X, Y)
+        Z[missing] = interpolate.griddata((XG[~missing], YG[~missing]), Z[~missing],
+                                          (XG[missing], YG[missing]), method='nearest')
+    tolerance = MISSING_NODES_TOLERANCE * (Z.max() - Z.min())
+    for iteration in range(MISSING_NODES_ITERATIONS):
+        # Solve BX * C * BY^T = Z^T
+        CY = np.linalg.lstsq(BX, Z.transpose(), rcond=None)[0]
+        C = np.linalg.lstsq(BY, CY.transpose(), rcond=None)[0].transpose()
+        surface = np.dot(np.dot(BX, C), BY.transpose()).transpose()
+        if not missing.any():
+            break
+        change = np.abs(surface[missing] - Z[missing]).max()
+        Z[missing] = surface[missing]
+        if change <= tolerance:
+            break
+    residuals = (surface - Z)[~missing]
+    return [tx, ty, C.ravel(), kx, ky], np.sum(residuals**2)
+
+def detect_lattice(values):
+    """
+    Try to find regular lattice of values. Return tuple (spacing,
+    number of lattice nodes, lattice index of each value) or None,
+    when values are not placed on regular lattice. Values closer than
+    LATTICE_TOLERANCE relative to range of values are the same node.
+    Lattice with more than MAX_MISSING_NODES nodes without any value
+    can not be part of grid and it is not accepted too.
+    """
+    unique, inverse = np.unique(values, return_inverse=True)
+    if unique.size < 2:
+        return None
+    # Merge values of the same node (coordinates with rounding errors)
+    tolerance = LATTICE_TOLERANCE * (unique[-1] - unique[0])
+    node = np.concatenate(([0], np.cumsum(np.diff(unique) > tolerance)))
+    nodes = np.bincount(node, weights=unique) / np.bincount(node)
+    if nodes.size < 2:
+        return None
+    spacing = np.diff(nodes).min()
+    lattice = np.rint((nodes - nodes[0]) / spacing)
+    # Spacing of the whole range is more precise than the smallest difference
+    spacing = (nodes[-1] - nodes[0]) / lattice[-1]
+    offsets = (nodes - nodes[0]) / spacing
+    if np.abs(offsets - lattice).max() > min(LATTICE_TOLERANCE * lattice[-1], MAX_LATTICE_OFFSET):
+        return None
+    if nodes.size < (1.0 - MAX_MISSING_NODES) * (lattice[-1] + 1):
+        return None
+    return spacing, int(lattice[-1]) + 1, lattice.astype(int)[node][inverse]
+
+def bilinear_heights(heights, i, j, kx, ky):
+    """
+    Return bilinear interpolation of grid heights in cells (j, i) with
+    relative positions kx, ky in cells
+    """
+    z12 = (1.0 - kx) * heights[j, i] + kx * heights[j, i + 1]
+    z34 = (1.0 - kx) * heights[j + 1, i] + kx * heights[j + 1, i + 1]
+    return (1.0 - ky) * z12 + ky * z34
+
+def read_terrain_chunks(file_name, chunk_size):
+    """
+    Generator of (n, 3) arrays of terrain points read from text file by
+    chunks of chunk_size lines
+    """
+    with open(file_name, 'r') as data_file:
+        # Number of columns is given by the first line, only x, y, z are used
+        columns = len(data_file.readline().split())
+        data_file.seek(0)
+        while True:
+            lines = list(itertools.islice(data_file, chunk_size))
+            if len(lines) == 0:
+                break
+            data = np.fromstring(''.join(lines), dtype=np.float64, sep=' ')
+            if columns < 3 or data.size % columns != 0:
+                raise ValueError('Malformed terrain file: %s' % file_name)
+            yield data.reshape(-1, columns)[:, :3]
+
+def points_in_polygon(X, Y, polygon):
+    """
+    Return boolean array of points (X, Y) inside polygon (array of vertices)
+    using even-odd rule. Points are tested at once for each polygon edge.
+    """
+    inside = np.zeros(X.shape, dtype=bool)
+    for k in range(len(polygon)):
+        x0, y0 = polygon[k - 1]
+        x1, y1 = polygon[k]
+        # Edge crosses horizontal ray going from point to the right
+        crosses = (y0 > Y) != (y1 > Y)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            xi = x0 + (Y - y0) * (x1 - x0) / (y1 - y0)
+        inside ^= crosses & (X < xi)
+    return inside
+
+def distance_to_polygon(X, Y, polygon):
+    """
+    Return array of distances of points (X, Y) from border of polygon
+    """
+    dist2 = np.full(X.shape, np.inf)
+    for k in range(len(polygon)):
+        x0, y0 = polygon[k - 1]
+        ex, ey = polygon[k][0] - x0, polygon[k][1] - y0
+        length2 = ex**2 + ey**2
+        if length2 > 0.0:
+            t = np.clip(((X - x0) * ex + (Y - y0) * ey) / length2, 0.0, 1.0)
+        else:
+            t = 0.0
+        dist2 = np.minimum(dist2, (X - x0 - t * ex)**2 + (Y - y0 - t * ey)**2)
+    return np.sqrt(dist2)
+
+def binary_terrain_header(file_name):
+    """
+    Return name of yaml header file of binary terrain
+    """
+    return file_name + '.yaml'
+
 class TerrainData(object):
     """
     Class representing Terrain data (terrain, rivers, aproximation, etc)
@@ -19,13 +209,14 @@ class TerrainData(object):
         super(TerrainData, self).__init__()
         self.yaml_file_name = yaml_file_name
         self.conf = {} # Configuration loaded from yaml file
-        self.terrain_data = [] # Terrain data list of tuples (3d coordinates)
+        self.terrain_data = None # Terrain data numpy array (N, 3) of 3d coordinates
         self.point_count = 0
         self.tck = {} # Patches of b-spline surface
-        self.tX = None #
-        self.tY = None # Terrain X,Y,Z cache for numpy API
-        self.tZ = None #
         self.tW = None # Visualization purpose
+        self.grid_residuals = None # Numpy array (size_y, size_x) of residuals of grid nodes
+        self.fit_errors = {} # Max and RMS error of aproximation for each patch
+        self.samples = OrderedDict() # Cache of sampled patches (the least recently used first)
+        self.streaming = False # Terrain is not loaded to memory at once
         self.min_x = -sys.maxsize
         self.max_x = sys.maxsize
         self.min_y = -sys.maxsize
@@ -36,7 +227,10 @@ class TerrainData(object):
         self.diff_y = 0.0
         self.dx = 0.0
         self.dy = 0.0
-        self.grid = {} # Cache for bilinear interpolation
+        self.heights = None # Numpy array (size_y, size_x) of grid heights for bilinear interpolation
+        self.missing_nodes = 0 # Number of grid nodes not defined in terrain data
+        self.__scattered_interpolators = None # Interpolation of scattered terrain data
+        self.__filled_heights = None # Tuple (heights, heights with missing nodes filled by nearest nodes)
         self.rivers_data_2d = {}
         self.rivers_data_3d = {}
         self.area_borders_2d = {}
@@ -49,69 +243,198 @@ class TerrainData(object):
         with open(self.yaml_file_name, 'r') as yaml_file:
             self.conf = yaml.load(yaml_file)
 
+    @property
+    def terrain_data(self):
+        """
+        Terrain data numpy array (N, 3) of 3d coordinates. Points of memory
+        mapped grid are created, when they are used for the first time.
+        """
+        if self.__terrain_data is None and self.heights is not None:
+            j, i = np.nonzero(~np.isnan(self.heights))
+            self.__terrain_data = np.column_stack((self.min_x + self.dx * i,
+                                                   self.min_y + self.dy * j,
+                                                   self.heights[j, i]))
+            self.__grid_order = True
+        return self.__terrain_data
+
+    @terrain_data.setter
+    def terrain_data(self, value):
+        self.__terrain_data = value
+        # Points are ordered by rows of grid
+        self.__grid_order = False
+
+    # Terrain X,Y,Z columns for numpy API (views, not copies)
+    tX = property(lambda self: self.terrain_data[:, 0])
+    tY = property(lambda self: self.terrain_data[:, 1])
+    tZ = property(lambda self: self.terrain_data[:, 2])
+
     def __post_process_terrain_data(self):
         """
         Try to postprocess terrain data
         """
-        self.point_count = len(self.terrain_data)
-        self.tX = [item[0] for item in self.terrain_data]
-        self.tY = [item[1] for item in self.terrain_data]
-        self.tZ = [item[2] for item in self.terrain_data]
-
-        def find_first_different(array):
-            """Find index of first different item"""
-            index = 1
-            first = array[0]
-            while array[index] == first:
-                index += 1
-            index -= 1
-            if index < len(array):
-                return index
-            else:
-                return -1
-
-        def find_first_same(array):
-            """Find index of first same item"""
-            index = 1
-            first = array[0]
-            while array[index] != first:
-                index += 1
-            index -= 1
-            if index < len(array):
-                return index
-            else:
-                return -1
-
-        self.min_x = min(self.tX)
-        self.max_x = max(self.tX)
-        self.min_y = min(self.tY)
-        self.max_y = max(self.tY)
-        # Try to compute size of 2d array accordin repeated values
-        if self.tX[0] == self.tX[1]:
-            self.size_x = find_first_different(self.tX) + 1
-        else:
-            self.size_x = find_first_same(self.tX) + 1
-        self.size_y = self.point_count / self.size_x
+        self.point_count = self.terrain_data.shape[0]
+
+        self.min_x = self.tX.min()
+        self.max_x = self.tX.max()
+        self.min_y = self.tY.min()
+        self.max_y = self.tY.max()
         self.diff_x = self.max_x - self.min_x
         self.diff_y = self.max_y - self.min_y
-        self.dx = self.diff_x / float(self.size_x - 1)
-        self.dy = self.diff_y / float(self.size_y - 1)
-        self.grid = {}
-        #print size_x, size_y, diff_x, diff_y, dx, dy
-        for index in range(0, self.point_count):
-            i = int( math.floor( (self.terrain_data[index][0] - self.min_x) / self.dx ) )
-            j = int( math.floor( (self.terrain_data[index][1] - self.min_y) / self.dy ) )
-            self.grid[(i, j)] = (self.terrain_data[index][0], self.terrain_data[index][1], self.terrain_data[index][2])
+        self.heights = None
+        self.missing_nodes = 0
+        self.__scattered_interpolators = None
+
+        # Try to find regular grid in x, y coordinates. Order of points
+        # in the file does not matter.
+        lattice_x = detect_lattice(self.tX)
+        lattice_y = detect_lattice(self.tY)
+        if lattice_x is not None and lattice_y is not None and \
+                lattice_x[1] * lattice_y[1] * (1.0 - MAX_MISSING_NODES) <= self.point_count:
+            self.dx, self.size_x, i = lattice_x
+            self.dy, self.size_y, j = lattice_y
+            # Each node of the grid can be defined only once and grid has
+            # to be reasonably dense
+            counts = np.bincount(j * self.size_x + i, minlength=self.size_x * self.size_y)
+            self.missing_nodes = int(np.count_nonzero(counts == 0))
+            if counts.max() == 1 and self.missing_nodes <= MAX_MISSING_NODES * counts.size:
+                # Grid with origin (min_x, min_y) and spacing (dx, dy); node [j, i] has
+                # coordinates (min_x + i * dx, min_y + j * dy). Missing nodes are NaN.
+                self.heights = np.full((self.size_y, self.size_x), np.nan)
+                self.heights[j, i] = self.tZ
+                return
+
+        # Scattered data; nominal spacing is used for sampling of surface
+        self.size_x = 0
+        self.size_y = 0
+        self.missing_nodes = 0
+        nominal_size = max(math.sqrt(self.point_count) - 1.0, 1.0)
+        self.dx = self.diff_x / nominal_size
+        self.dy = self.diff_y / nominal_size
 
     def load_terrain(self):
         """
-        Try to load data of terain
+        Try to load data of terain. Files with extension .npy are memory
+        mapped binary terrain created by save_terrain.
+
+        In streaming mode, text grid is converted to binary file by blocks
+        of lines first (it is done only once, when binary file is older
+        than text file). Terrain data are never loaded to memory at once;
+        approximation reads only rows of current tile and sampling reads
+        only nodes around sampled points.
         """
+        self.streaming = self.conf.get('streaming', False)
+        if self.conf['terrain'].endswith(BINARY_TERRAIN_SUFFIX):
+            self.__load_binary_terrain(self.conf['terrain'])
+            return
+        if self.streaming is True:
+            # Text grid is converted to binary file once and memory mapped
+            binary_file_name = self.conf['terrain'] + BINARY_TERRAIN_SUFFIX
+            if not os.path.exists(binary_file_name) or \
+                    os.path.getmtime(binary_file_name) < os.path.getmtime(self.conf['terrain']):
+                self.__stream_terrain_to_binary(self.conf['terrain'], binary_file_name)
+            self.__load_binary_terrain(binary_file_name)
+            return
         with open(self.conf['terrain'], 'r') as data_file:
-            for line in data_file:
-                self.terrain_data.append( tuple( float(item) for item in line.split() ) )
+            # Number of columns is given by the first line, only x, y, z are used
+            columns = len(data_file.readline().split())
+            data_file.seek(0)
+            # Parse whole file in one pass of numpy C parser
+            data = np.fromfile(data_file, dtype=np.float64, sep=' ')
+        if columns < 3 or data.size % columns != 0:
+            raise ValueError('Malformed terrain file: %s' % self.conf['terrain'])
+        self.terrain_data = np.ascontiguousarray(data.reshape(-1, columns)[:, :3])
         self.__post_process_terrain_data()
 
+    def __load_binary_terrain(self, file_name):
+        """
+        Memory map binary terrain. Only header is read, grid heights are
+        read from disk when they are accessed.
+        """
+        with open(binary_terrain_header(file_name), 'r') as header_file:
+            header = yaml.safe_load(header_file)
+        data = np.load(file_name, mmap_mode='r')
+        if header['grid'] is False:
+            self.terrain_data = data
+            self.__post_process_terrain_data()
+            return
+        self.heights = data
+        self.size_y, self.size_x = data.shape
+        for name in ('point_count', 'missing_nodes', 'min_x', 'max_x', 'min_y', 'max_y', 'dx', 'dy'):
+            setattr(self, name, header[name])
+        self.diff_x = self.max_x - self.min_x
+        self.diff_y = self.max_y - self.min_y
+        self.terrain_data = None
+
+    def save_terrain(self, file_name, dtype=np.float64):
+        """
+        Save terrain to binary file (.npy), which can be memory mapped by
+        load_terrain. Grid is saved as 2D array of heights of type dtype,
+        scattered data as array of points. Georeference is saved in yaml
+        header file.
+        """
+        if self.heights is not None:
+            np.save(file_name, self.heights.astype(dtype))
+        else:
+            # Coordinates of scattered points need full precision
+            np.save(file_name, self.terrain_data.astype(np.float64))
+        self.__save_binary_header(file_name)
+
+    def __save_binary_header(self, file_name):
+        """
+        Save yaml header of binary terrain
+        """
+        header = {'grid': self.heights is not None}
+        if self.heights is not None:
+            header['point_count'] = int(self.point_count)
+            header['missing_nodes'] = int(self.missing_nodes)
+            for name in ('min_x', 'max_x', 'min_y', 'max_y', 'dx', 'dy'):
+                header[name] = float(getattr(self, name))
+        with open(binary_terrain_header(file_name), 'w') as header_file:
+            yaml.safe_dump(header, header_file, default_flow_style=False)
+
+    def __stream_terrain_to_binary(self, text_file_name, binary_file_name):
+        """
+        Convert text grid to binary terrain by chunks of lines. The first
+        pass finds grid lines, the second pass writes heights to memory
+        mapped file. Only chunk of lines and coordinates of grid lines
+        are held in memory.
+        """
+        chunk_size = self.conf.get('chunk_size', STREAMING_CHUNK_SIZE)
+        unique_x = np.empty(0)
+        unique_y = np.empty(0)
+        point_count = 0
+        for chunk in read_terrain_chunks(text_file_name, chunk_size):
+            unique_x = np.union1d(unique_x, chunk[:, 0])
+            unique_y = np.union1d(unique_y, chunk[:, 1])
+            point_count += chunk.shape[0]
+        lattice_x = detect_lattice(unique_x)
+        lattice_y = detect_lattice(unique_y)
+        # Grid has to be reasonably dense, before it is allocated on disk
+        if lattice_x is None or lattice_y is None or \
+                lattice_x[1] * lattice_y[1] * (1.0 - MAX_MISSING_NODES) > point_count:
+            raise ValueError('Streaming mode requires terrain on regular grid: %s' % text_file_name)
+        self.dx, self.size_x = lattice_x[:2]
+        self.dy, self.size_y = lattice_y[:2]
+        self.min_x, self.max_x = unique_x[0], unique_x[-1]
+        self.min_y, self.max_y = unique_y[0], unique_y[-1]
+
+        self.heights = np.lib.format.open_memmap(binary_file_name, mode='w+',
+                                                 dtype=np.float64, shape=(self.size_y, self.size_x))
+        self.heights[:] = np.nan
+        for chunk in read_terrain_chunks(text_file_name, chunk_size):
+            i = np.rint((chunk[:, 0] - self.min_x) / self.dx).astype(int)
+            j = np.rint((chunk[:, 1] - self.min_y) / self.dy).astype(int)
+            self.heights[j, i] = chunk[:, 2]
+        # Count missing nodes by blocks of rows
+        self.missing_nodes = 0
+        rows = max(chunk_size // self.size_x, 1)
+        for j0 in range(0, self.size_y, rows):
+            self.missing_nodes += int(np.count_nonzero(np.isnan(self.heights[j0:j0 + rows])))
+        self.point_count = self.size_x * self.size_y - self.missing_nodes
+        self.heights.flush()
+        self.__save_binary_header(binary_file_name)
+        self.heights = None
+
     def load_rivers(self):
         """
         Try to load data of rivers
@@ -138,177 +461,493 @@ class TerrainData(object):
                 # Only one border ATM
                 self.area_borders_2d[0].append( tuple( float(item) for item in items[1:]) )
 
+    def simplify_2d_polylines(self, tolerance):
+        """
+        Remove points of rivers and area borders, which are not needed for
+        representation of polylines with given tolerance
+        """
+        self.rivers_data_2d = simplify_polylines(self.rivers_data_2d, tolerance)
+        self.area_borders_2d = simplify_polylines(self.area_borders_2d, tolerance)
+
+    def clip_terrain(self, margin=0.0):
+        """
+        Remove terrain points outside of area border and farther than margin
+        from the border. Only points in bounding box of the area are tested.
+        Grid is cropped to bounding box and removed nodes become missing
+        nodes of the grid. Nodes of grid cells crossed by the border are
+        always kept, so the border can be sampled by sample_heights.
+        """
+        polygon = np.asarray(self.area_borders_2d[0], dtype=np.float64)[:, :2]
+        if self.heights is not None:
+            margin += math.hypot(self.dx, self.dy)
+        box = (polygon[:, 0].min() - margin, polygon[:, 1].min() - margin,
+               polygon[:, 0].max() + margin, polygon[:, 1].max() + margin)
+
+        def in_area(X, Y):
+            """Return boolean array of points inside area with margin"""
+            keep = points_in_polygon(X, Y, polygon)
+            if margin > 0.0:
+                keep[~keep] = distance_to_polygon(X[~keep], Y[~keep], polygon) <= margin
+            return keep
+
+        if self.heights is None:
+            candidates = np.flatnonzero((self.tX >= box[0]) & (self.tX <= box[2]) &
+                                        (self.tY >= box[1]) & (self.tY <= box[3]))
+            keep = candidates[in_area(self.tX[candidates], self.tY[candidates])]
+            self.terrain_data = self.terrain_data[keep]
+            self.__post_process_terrain_data()
+            return
+
+        i0 = max(int(math.floor((box[0] - self.min_x) / self.dx)), 0)
+        j0 = max(int(math.floor((box[1] - self.min_y) / self.dy)), 0)
+        i1 = min(int(math.ceil((box[2] - self.min_x) / self.dx)), self.size_x - 1)
+        j1 = min(int(math.ceil((box[3] - self.min_y) / self.dy)), self.size_y - 1)
+        heights = np.array(self.heights[j0:j1 + 1, i0:i1 + 1], dtype=np.float64)
+        XG, YG = np.meshgrid(self.min_x + self.dx * np.arange(i0, i1 + 1),
+                             self.min_y + self.dy * np.arange(j0, j1 + 1))
+        heights[~in_area(XG, YG)] = np.nan
+        self.heights = heights
+        self.size_y, self.size_x = heights.shape
+        self.min_x += self.dx * i0
+        self.min_y += self.dy * j0
+        self.max_x = self.min_x + self.dx * (self.size_x - 1)
+        self.max_y = self.min_y + self.dy * (self.size_y - 1)
+        self.diff_x = self.max_x - self.min_x
+        self.diff_y = self.max_y - self.min_y
+        self.missing_nodes = int(np.count_nonzero(np.isnan(heights)))
+        self.point_count = heights.size - self.missing_nodes
+        # Points will be created from the grid
+        self.terrain_data = None
+
+    def __tile_ranges(self, size):
+        """
+        Split range of nodes 0 ... size - 1 to tiles of tile_size nodes
+        sharing border nodes. Too small last tile is merged with previous.
+        """
+        tile_size = self.conf.get('tile_size') or size - 1
+        bounds = list(range(0, size - 1, tile_size)) + [size - 1]
+        if len(bounds) > 2 and bounds[-1] - bounds[-2] < tile_size // 2:
+            del bounds[-2]
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def __tile_points(self, limit, as_grid=False):
+        """
+        Return X, Y, Z arrays of terrain points inside limit
+        (min_x, min_y, max_x, max_y). When as_grid is True and terrain is
+        grid, X and Y are coordinates of grid lines and Z is 2D array of
+        heights with NaN in missing nodes.
+        """
+        if self.heights is not None:
+            # Read only nodes of the tile from grid
+            i0 = max(int(math.ceil((limit[0] - self.min_x) / self.dx - LATTICE_TOLERANCE)), 0)
+            j0 = max(int(math.ceil((limit[1] - self.min_y) / self.dy - LATTICE_TOLERANCE)), 0)
+            i1 = min(int(math.floor((limit[2] - self.min_x) / self.dx + LATTICE_TOLERANCE)), self.size_x - 1)
+            j1 = min(int(math.floor((limit[3] - self.min_y) / self.dy + LATTICE_TOLERANCE)), self.size_y - 1)
+            Z = self.heights[j0:j1 + 1, i0:i1 + 1]
+            XB = self.min_x + self.dx * np.arange(i0, i1 + 1)
+            YB = self.min_y + self.dy * np.arange(j0, j1 + 1)
+            if as_grid is True:
+                return XB, YB, np.array(Z)
+            defined = ~np.isnan(Z)
+            XG, YG = np.meshgrid(XB, YB)
+            return XG[defined], YG[defined], Z[defined]
+        inside = (self.tX >= limit[0]) & (self.tX <= limit[2]) & \
+                 (self.tY >= limit[1]) & (self.tY <= limit[3])
+        return self.tX[inside], self.tY[inside], self.tZ[inside]
+
     def aproximate_terrain(self):
         """
-        Try to aproximate terrain with bspline surface
-        """
-        # dx = (self.size_x / 2) * self.dx
-        # dy = (self.size_y / 2) * self.dy
-        # tot_fp = 0
-
-        # X = []
-        # Y = []
-        # Z = []
-        # for i in range(0, self.size_x/2 + 2):
-        #     for j in range(0, self.size_y/2 + 2):
-        #         X.append(self.grid[(i,j)][0])
-        #         Y.append(self.grid[(i,j)][1])
-        #         Z.append(self.grid[(i,j)][2])
-        # # kx an ky are degrees of polynoms
-        # # s is smoothness
-        # tck,fp,ior,msg = interpolate.bisplrep(X, Y, Z, kx=5, ky=5, full_output=1)
-        # self.tck[(self.min_x, self.min_y, self.min_x + dx, self.min_y + dy)] = tck
-        # tot_fp += fp
-        # print tck, fp
-
-        # X = []
-        # Y = []
-        # Z = []
-        # for i in range(self.size_x/2 - 2, self.size_x):
-        #     for j in range(0, self.size_y/2 + 2):
-        #         X.append(self.grid[(i,j)][0])
-        #         Y.append(self.grid[(i,j)][1])
-        #         Z.append(self.grid[(i,j)][2])
-        # tck,fp,ior,msg = interpolate.bisplrep(X, Y, Z, kx=5, ky=5, full_output=1)
-        # self.tck[(self.min_x + dx, self.min_y, self.max_x, self.min_y + dy)] = tck
-        # tot_fp += fp
-        # print tck, fp
-
-        # X = []
-        # Y = []
-        # Z = []
-        # for i in range(0, self.size_x/2 + 2):
-        #     for j in range(self.size_y/2 - 2, self.size_y):
-        #         X.append(self.grid[(i,j)][0])
-        #         Y.append(self.grid[(i,j)][1])
-        #         Z.append(self.grid[(i,j)][2])
-        # tck,fp,ior,msg = interpolate.bisplrep(X, Y, Z, kx=5, ky=5, full_output=1)
-        # self.tck[(self.min_x, self.min_y + dy, self.min_x + dx, self.max_y)] = tck
-        # tot_fp += fp
-        # print tck, fp
-
-        # X = []
-        # Y = []
-        # Z = []
-        # for i in range(self.size_x/2 - 2, self.size_x):
-        #     for j in range(self.size_y/2 - 2, self.size_y):
-        #         X.append(self.grid[(i,j)][0])
-        #         Y.append(self.grid[(i,j)][1])
-        #         Z.append(self.grid[(i,j)][2])
-        # tck,fp,ior,msg = interpolate.bisplrep(X, Y, Z, kx=5, ky=5, full_output=1)
-        # self.tck[(self.min_x + dx, self.min_y + dy, self.max_x, self.max_y)] = tck
-        # tot_fp += fp
-        # print tck, fp
-
-        tck,fp,ior,msg = interpolate.bisplrep(self.tX, self.tY, self.tZ, kx=5, ky=5, full_output=1)
-        self.tck[(self.min_x, self.min_y, self.max_x, self.max_y)] = tck
+        Try to aproximate terrain with bspline surface. Terrain is split to
+        tiles of tile_size x tile_size grid cells, which are aproximated by
+        independent patches in parallel processes. Each patch is fitted to
+        points of its tile extended by tile_overlap cells on each side.
+
+        With fit_method 'lsq', knots are not placed by smoothing, but on
+        lattice with knot_spacing_x and knot_spacing_y (common for all tiles)
+        and every patch is computed by one least squares solution.
+
+        When cache_dir is set, patches are loaded from persistent cache
+        instead of aproximation, if terrain file and configuration has not
+        been changed since previous run.
+        """
+        cache = None
+        if self.conf.get('cache_dir') is not None:
+            cache = FitCache(self.conf['cache_dir'], self.conf.get('cache_size', 512) * 1024 * 1024)
+            file_names = [self.yaml_file_name, self.conf['terrain']]
+            if self.conf.get('clip_margin') is not None:
+                # Clipped terrain depends on area border too
+                file_names.append(self.conf['area'])
+            key = cache.key(file_names, ('load_points.aproximate_terrain', sorted(self.conf.items())))
+            tck = cache.load(key)
+            if tck is not None:
+                self.tck = tck
+                self.samples.clear()
+                self.compute_residuals()
+                return
+
+        kx = self.conf.get('kx', 5)
+        ky = self.conf.get('ky', 5)
+        overlap = self.conf.get('tile_overlap', 2)
+        lsq = self.conf.get('fit_method', 'smooth') == 'lsq'
+        knot_spacing_x = self.conf.get('knot_spacing_x', 4.0 * self.dx)
+        knot_spacing_y = self.conf.get('knot_spacing_y', 4.0 * self.dy)
+
+        def interior_knots(values, origin, spacing):
+            """Return knots of lattice inside range of values"""
+            first = int(math.floor((values.min() - origin) / spacing)) + 1
+            last = int(math.ceil((values.max() - origin) / spacing)) - 1
+            return origin + spacing * np.arange(first, last + 1)
+        # Scattered data are split according nominal spacing
+        size_x = int(round(self.diff_x / self.dx)) + 1
+        size_y = int(round(self.diff_y / self.dy)) + 1
+
+        limits = []
+        tasks = []
+        for i0, i1 in self.__tile_ranges(size_x):
+            for j0, j1 in self.__tile_ranges(size_y):
+                limit = (self.min_x + self.dx * i0, self.min_y + self.dy * j0,
+                         self.min_x + self.dx * i1, self.min_y + self.dy * j1)
+                X, Y, Z = self.__tile_points((limit[0] - overlap * self.dx, limit[1] - overlap * self.dy,
+                                              limit[2] + overlap * self.dx, limit[3] + overlap * self.dy),
+                                             as_grid=lsq)
+                if np.count_nonzero(~np.isnan(Z)) < (kx + 1) * (ky + 1):
+                    # Tile outside of clipped area
+                    continue
+                knots = None
+                if lsq is True:
+                    knots = (interior_knots(X, self.min_x, knot_spacing_x),
+                             interior_knots(Y, self.min_y, knot_spacing_y))
+                limits.append(limit)
+                tasks.append((X, Y, Z, kx, ky, knots))
+
+        # kx an ky are degrees of polynoms
+        if len(tasks) > 1 and self.conf.get('processes') != 1:
+            with closing(multiprocessing.Pool(self.conf.get('processes'))) as pool:
+                results = pool.map(fit_tile, tasks)
+        else:
+            results = [fit_tile(task) for task in tasks]
+
+        tot_fp = 0.0
+        self.tck = {}
+        self.samples.clear()
+        for limit, (tck, fp) in zip(limits, results):
+            self.tck[limit] = tck
+            tot_fp += fp
+        print tot_fp
+        if cache is not None:
+            cache.save(key, self.tck)
+
         # Compute difference between original terrain data and b-spline surface
-        self.tW = [abs(it[2] - interpolate.bisplev(it[0], it[1], tck)) for it in self.terrain_data]
-        print tck
-        print fp
+        self.compute_residuals()
+
+    def sample_surface(self, limit, step_x=None, step_y=None):
+        """
+        Return tuple (XB, YB, ZB) of patch with limit sampled on lattice
+        with steps step_x and step_y (grid spacing by default) anchored in
+        origin of terrain. ZB is 2D array (len(XB), len(YB)) of heights.
+        Sampled patches are cached, the least recently used are removed
+        when cache has more than samples_cache_size items. Patches are not
+        cached, when samples_cache_size is not positive.
+        """
+        step_x = step_x or self.dx
+        step_y = step_y or self.dy
+        key = (limit, step_x, step_y)
+        try:
+            samples = self.samples.pop(key)
+        except KeyError:
+            i0 = int(math.ceil((limit[0] - self.min_x) / step_x - LATTICE_TOLERANCE))
+            j0 = int(math.ceil((limit[1] - self.min_y) / step_y - LATTICE_TOLERANCE))
+            i1 = int(math.floor((limit[2] - self.min_x) / step_x + LATTICE_TOLERANCE))
+            j1 = int(math.floor((limit[3] - self.min_y) / step_y + LATTICE_TOLERANCE))
+            XB = self.min_x + step_x * np.arange(i0, i1 + 1)
+            YB = self.min_y + step_y * np.arange(j0, j1 + 1)
+            ZB = interpolate.bisplev(XB, YB, self.tck[limit]).reshape(XB.size, YB.size)
+            samples = (XB, YB, ZB)
+            cache_size = self.conf.get('samples_cache_size', SAMPLES_CACHE_SIZE)
+            if cache_size <= 0:
+                # Caching is disabled
+                return samples
+            while len(self.samples) >= cache_size:
+                self.samples.popitem(last=False)
+        # Mark samples as recently used
+        self.samples[key] = samples
+        return samples
+
+    def compute_residuals(self):
+        """
+        Compute differences between terrain data and b-spline surface.
+        Grid tiles are evaluated by one call of bisplev on the tile grid,
+        scattered points are evaluated in batches. Set tW (absolute
+        difference of each terrain point) and fit_errors dictionary
+        with tuples (max, rms) of each tile and of whole terrain ('total').
+        """
+        self.fit_errors = {}
+        self.tW = None
+        self.grid_residuals = None
+        if self.streaming is True:
+            # Residuals of all points are not stored, memory would not be
+            # bounded by size of tile
+            total_max = 0.0
+            total_sum = 0.0
+            total_count = 0
+        elif self.heights is not None:
+            residuals = np.full(self.heights.shape, np.nan)
+        else:
+            self.tW = np.full(self.point_count, np.nan)
+        for limit, tck in self.tck.items():
+            if self.heights is not None:
+                i0 = int(round((limit[0] - self.min_x) / self.dx))
+                j0 = int(round((limit[1] - self.min_y) / self.dy))
+                i1 = int(round((limit[2] - self.min_x) / self.dx))
+                j1 = int(round((limit[3] - self.min_y) / self.dy))
+                XB, YB, ZB = self.sample_surface(limit)
+                tile_residuals = np.abs(self.heights[j0:j1 + 1, i0:i1 + 1] - ZB.transpose())
+                if self.streaming is False:
+                    residuals[j0:j1 + 1, i0:i1 + 1] = tile_residuals
+                tile_residuals = tile_residuals[~np.isnan(tile_residuals)]
+            else:
+                inside = np.flatnonzero((self.tX >= limit[0]) & (self.tX <= limit[2]) &
+                                        (self.tY >= limit[1]) & (self.tY <= limit[3]))
+                spline = interpolate.BivariateSpline._from_tck(tck)
+                tile_residuals = np.empty(inside.size)
+                for start in range(0, inside.size, RESIDUALS_BATCH_SIZE):
+                    batch = inside[start:start + RESIDUALS_BATCH_SIZE]
+                    tile_residuals[start:start + batch.size] = np.abs(
+                        self.tZ[batch] - spline.ev(self.tX[batch], self.tY[batch]))
+                if self.streaming is False:
+                    self.tW[inside] = tile_residuals
+            if tile_residuals.size > 0:
+                self.fit_errors[limit] = (tile_residuals.max(),
+                                          math.sqrt(np.dot(tile_residuals, tile_residuals) / tile_residuals.size))
+                if self.streaming is True:
+                    total_max = max(total_max, tile_residuals.max())
+                    total_sum += np.dot(tile_residuals, tile_residuals)
+                    total_count += tile_residuals.size
+
+        if self.streaming is True:
+            # Border nodes shared by tiles are counted in each tile
+            self.fit_errors['total'] = (total_max, math.sqrt(total_sum / max(total_count, 1)))
+        elif self.heights is not None and (self.__terrain_data is None or self.__grid_order is True):
+            self.tW = residuals[~np.isnan(self.heights)]
+        elif self.heights is not None:
+            i = np.rint((self.tX - self.min_x) / self.dx).astype(int)
+            j = np.rint((self.tY - self.min_y) / self.dy).astype(int)
+            self.tW = residuals[j, i]
+        if self.streaming is False:
+            # Border nodes shared by tiles are counted once for total error
+            # Points of skipped tiles are not included
+            if self.heights is not None:
+                # Kept for decimated display of grid
+                self.grid_residuals = residuals
+            residuals = self.tW[~np.isnan(self.tW)]
+            self.fit_errors['total'] = (residuals.max(), math.sqrt(np.dot(residuals, residuals) / residuals.size))
+        print 'max error: ', self.fit_errors['total'][0], ' rms: ', self.fit_errors['total'][1]
+
+    def sample_heights(self, xy_array):
+        """
+        Compute z coordinates of points given by (M, 2) array of x, y
+        coordinates using bilinear interpolation of terrain grid. Points
+        outside the grid are extrapolated from the nearest grid cell.
+        Missing nodes of cells are replaced by the nearest defined nodes.
+        Heights of scattered terrain data are interpolated linearly on
+        Delaunay triangulation (nearest point outside of convex hull).
+        """
+        xy_array = np.asarray(xy_array, dtype=np.float64).reshape(-1, 2)
+        if self.heights is None:
+            return self.__sample_scattered_heights(xy_array)
+        # Compute indexes to the grid first
+        fx = (xy_array[:, 0] - self.min_x) / self.dx
+        fy = (xy_array[:, 1] - self.min_y) / self.dy
+        i = np.clip(np.floor(fx).astype(int), 0, self.size_x - 2)
+        j = np.clip(np.floor(fy).astype(int), 0, self.size_y - 2)
+        # Compute weights for bilinear interpolation
+        kx = fx - i
+        ky = fy - j
+        heights = self.heights
+        Z = bilinear_heights(heights, i, j, kx, ky)
+        missing = np.isnan(Z)
+        if missing.any():
+            # Cells with missing nodes
+            if self.__filled_heights is None or self.__filled_heights[0] is not heights:
+                indices = ndimage.distance_transform_edt(np.isnan(heights), return_distances=False,
+                                                         return_indices=True)
+                self.__filled_heights = (heights, np.asarray(heights)[tuple(indices)])
+            Z[missing] = bilinear_heights(self.__filled_heights[1], i[missing], j[missing],
+                                          kx[missing], ky[missing])
+        return Z
+
+    def __sample_scattered_heights(self, xy_array):
+        """
+        Compute z coordinates of points for scattered terrain data
+        """
+        if self.__scattered_interpolators is None:
+            points = self.terrain_data[:, :2]
+            self.__scattered_interpolators = (
+                interpolate.LinearNDInterpolator(points, self.tZ),
+                interpolate.NearestNDInterpolator(points, self.tZ))
+        linear, nearest = self.__scattered_interpolators
+        Z = linear(xy_array)
+        outside = np.isnan(Z)
+        if outside.any():
+            Z[outside] = nearest(xy_array[outside])
+        return Z
+
+    def __drape_polylines(self, polylines_2d, monotone=False):
+        """
+        Compute 3d polylines from dictionary of 2d polylines using one call
+        of sample_heights for all points. When monotone is True, z
+        coordinates of each polyline are never increasing.
+        """
+        keys = list(polylines_2d.keys())
+        if len(keys) == 0:
+            return {}
+        arrays = [np.asarray(polylines_2d[key], dtype=np.float64)[:, :2] for key in keys]
+        offsets = np.cumsum([0] + [len(array) for array in arrays])
+        Z = self.sample_heights(np.concatenate(arrays))
+        polylines_3d = {}
+        for index, key in enumerate(keys):
+            z = Z[offsets[index]:offsets[index + 1]]
+            if monotone is True:
+                # Cut out too big z values
+                z = np.fmin.accumulate(z)
+            polylines_3d[key] = np.column_stack((arrays[index], z))
+        return polylines_3d
 
     def aproximate_2d_borders(self):
         """
         Try to aproximate z coordinates of borders using terrain data
         """
-        
-        for border_id,border_2d in self.area_borders_2d.items():
-            self.area_borders_3d[border_id] = []
-            for bp in border_2d:
-                # Compute indexes to the grid first
-                i = int(math.floor( (bp[0] - self.min_x) / self.dx ))
-                j = int(math.floor( (bp[1] - self.min_y) / self.dy ))
-                # Compute weights for bilineral intebpolation
-                kx = (bp[0] - (self.min_x + self.dx * i)) / self.dx
-                ky = (bp[1] - (self.min_y + self.dy * j)) / self.dy
-                z1 = self.grid[(i, j)][2]
-                z2 = self.grid[(i + 1, j)][2]
-                z3 = self.grid[(i, j + 1)][2]
-                z4 = self.grid[(i + 1, j + 1)][2]
-                z12 = (1.0 - kx) * z1 + kx * z2
-                z34 = (1.0 - kx) * z3 + kx * z4
-                Z = (1.0 - ky) * z12 + ky * z34
-                self.area_borders_3d[border_id].append( (bp[0], bp[1], Z) )
-
+        self.area_borders_3d = self.__drape_polylines(self.area_borders_2d)
 
     def aproximate_2d_rivers(self):
         """
         Try to aproximate z coordinates of rivers using terrain data
         """
-        
-        for river_id,river2d in self.rivers_data_2d.items():
-            self.rivers_data_3d[river_id] = []
-            last_z = sys.maxsize
-            for rp in river2d:
-                # Compute indexes to the grid first
-                i = int(math.floor( (rp[0] - self.min_x) / self.dx ))
-                j = int(math.floor( (rp[1] - self.min_y) / self.dy ))
-                # Compute weights for bilineral interpolation
-                kx = (rp[0] - (self.min_x + self.dx * i)) / self.dx
-                ky = (rp[1] - (self.min_y + self.dy * j)) / self.dy
-                z1 = self.grid[(i, j)][2]
-                z2 = self.grid[(i + 1, j)][2]
-                z3 = self.grid[(i, j + 1)][2]
-                z4 = self.grid[(i + 1, j + 1)][2]
-                z12 = (1.0 - kx) * z1 + kx * z2
-                z34 = (1.0 - kx) * z3 + kx * z4
-                Z = (1.0 - ky) * z12 + ky * z34
-                # Cut out too big z values
-                if last_z < Z:
-                    #print 'last_z: ', last_z, ' < Z: ', Z, ' dz: ', Z - last_z
-                    Z = last_z
-                last_z = Z 
-                self.rivers_data_3d[river_id].append( (rp[0], rp[1], Z) )
+        self.rivers_data_3d = self.__drape_polylines(self.rivers_data_2d, monotone=True)
 
-    def display_terrain(self):
+    def __grid_points(self, step):
         """
-        Try to display terrain
+        Return X, Y, Z, W arrays of defined nodes in every step-th row and
+        column of grid. W are residuals of nodes (None, when residuals of
+        grid are not known).
         """
+        Z = np.array(self.heights[::step, ::step])
+        j, i = np.nonzero(~np.isnan(Z))
+        W = None
+        if self.grid_residuals is not None:
+            W = self.grid_residuals[::step, ::step][j, i]
+        return self.min_x + self.dx * step * i, self.min_y + self.dy * step * j, Z[j, i], W
 
-        fig = plt.figure()
-        ax = fig.gca(projection='3d')
-        plt.hold(True)
+    def __draw_terrain(self, fig, ax, max_points=None, max_cells=None):
+        """
+        Draw terrain points, rivers, borders and bspline patches to axes.
+        When max_points is set, only every n-th terrain point (node in every
+        n-th row and column of grid) is drawn.
+        When max_cells is set, surface is drawn with stride giving at most
+        max_cells cells in each direction.
+        """
+        point_step = 1
+        if max_points is not None:
+            point_step = max(int(math.ceil(self.point_count / float(max_points))), 1)
+        stride = 1
+        if max_cells is not None:
+            cells = max(int(round(self.diff_x / self.dx)), int(round(self.diff_y / self.dy)))
+            stride = max(int(math.ceil(cells / float(max_cells))), 1)
 
-        if self.tW is not None:
-            terrain_points = ax.scatter(self.tX, self.tY, self.tZ, c=self.tW)
+        if self.heights is not None:
+            # Points are created only for every n-th row and column of
+            # grid, terrain_data are not created for (memory mapped) grid
+            X, Y, Z, W = self.__grid_points(int(math.ceil(math.sqrt(point_step))))
+        else:
+            X, Y, Z = self.tX[::point_step], self.tY[::point_step], self.tZ[::point_step]
+            W = self.tW[::point_step] if self.tW is not None else None
+        if W is not None:
+            terrain_points = ax.scatter(X, Y, Z, c=W)
             fig.colorbar(terrain_points, shrink=0.5, aspect=5)
         else:
-            terrain_points = ax.scatter(self.tX, self.tY, self.tZ)
+            terrain_points = ax.scatter(X, Y, Z)
 
         # Draw rivers
         for river_id,river in self.rivers_data_3d.items():
-            rx = [item[0] for item in river]
-            ry = [item[1] for item in river]
-            rz = [item[2] for item in river]
-            ax.plot(rx, ry, rz, label=str(river_id))
+            ax.plot(river[:, 0], river[:, 1], river[:, 2], label=str(river_id))
 
         # Draw borders
         for border_id,border in self.area_borders_3d.items():
-            bx = [item[0] for item in border]
-            by = [item[1] for item in border]
-            bz = [item[2] for item in border]
             # Make sure border is displayed as cyclic polyline
-            bx.append(bx[0])
-            by.append(by[0])
-            bz.append(bz[0])
-            ax.plot(bx, by, bz)
+            border = np.vstack((border, border[:1]))
+            ax.plot(border[:, 0], border[:, 1], border[:, 2])
 
         # Draw bspline patches
-        for limit,tck in self.tck.items():
-            min_x = limit[0]
-            min_y = limit[1]
-            max_x = limit[2]
-            max_y = limit[3]
-            XB = np.arange(min_x, max_x + self.dx / 2.0, self.dx)
-            YB = np.arange(min_y, max_y + self.dy / 2.0, self.dy)
+        for limit in self.tck.keys():
+            XB, YB, ZB = self.sample_surface(limit)
             XG,YG = np.meshgrid(XB, YB)
-            ZB = interpolate.bisplev(XB, YB, tck)
-            surf = ax.plot_surface(XG.transpose(), YG.transpose(), ZB, color='gray', shade=True, alpha=0.5, antialiased=False, rstride=1, cstride=1)
+            surf = ax.plot_surface(XG.transpose(), YG.transpose(), ZB, color='gray', shade=True, alpha=0.5, antialiased=False, rstride=stride, cstride=stride)
             surf.set_linewidth(0)
 
+    def display_terrain(self):
+        """
+        Try to display terrain
+        """
+
+        fig = plt.figure()
+        ax = fig.gca(projection='3d')
+        plt.hold(True)
+
+        if self.streaming is True:
+            self.__draw_terrain(fig, ax, max_points=STREAMING_DISPLAY_POINTS)
+        else:
+            self.__draw_terrain(fig, ax)
+
         plt.show()
 
-def main(yaml_conf_filename):
+    def render_terrain(self, file_name, width=800, height=600):
+        """
+        Render terrain to PNG image of width x height pixels without
+        interactive backend (Agg canvas). Number of drawn terrain points and
+        surface cells is reduced according size of image.
+        """
+        fig = Figure(figsize=(width / float(PREVIEW_DPI), height / float(PREVIEW_DPI)), dpi=PREVIEW_DPI)
+        canvas = FigureCanvasAgg(fig)
+        ax = fig.add_subplot(111, projection='3d')
+
+        self.__draw_terrain(fig, ax,
+                            max_points=width * height // PREVIEW_PIXELS_PER_POINT,
+                            max_cells=max(width, height) // PREVIEW_PIXELS_PER_CELL)
+
+        canvas.print_png(file_name)
+
+    def export_stl(self, file_name, step_x=None, step_y=None):
+        """
+        Save bspline patches sampled with steps step_x and step_y (see
+        sample_surface) as triangular mesh to binary STL file
+        """
+        triangles = []
+        for limit in self.tck.keys():
+            XB, YB, ZB = self.sample_surface(limit, step_x, step_y)
+            XG, YG = np.meshgrid(XB, YB, indexing='ij')
+            nodes = np.dstack((XG, YG, ZB))
+            # Two triangles of each cell with counter clockwise vertices
+            a = nodes[:-1, :-1].reshape(-1, 3)
+            b = nodes[1:, :-1].reshape(-1, 3)
+            c = nodes[1:, 1:].reshape(-1, 3)
+            d = nodes[:-1, 1:].reshape(-1, 3)
+            triangles.append(np.stack((a, b, c), axis=1))
+            triangles.append(np.stack((a, c, d), axis=1))
+        triangles = np.concatenate(triangles) if len(triangles) > 0 else np.zeros((0, 3, 3))
+        normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+        lengths = np.sqrt(np.einsum('ij,ij->i', normals, normals))
+        normals /= np.where(lengths > 0.0, lengths, 1.0)[:, np.newaxis]
+        facets = np.zeros(len(triangles), dtype=np.dtype([
+            ('normal', '<f4', (3,)), ('vertices', '<f4', (3, 3)), ('attribute', '<u2')]))
+        facets['normal'] = normals
+        facets['vertices'] = triangles
+        with open(file_name, 'wb') as stl_file:
+            stl_file.write(b'load_points'.ljust(80, b' '))
+            np.array([len(facets)], dtype='<u4').tofile(stl_file)
+            facets.tofile(stl_file)
+
+def main(yaml_conf_filename, convert_filename=None, dtype='float64', stl_filename=None,
+         png_filename=None, png_size=(800, 600)):
     """
     Try to read data from all files
     """
@@ -316,19 +955,43 @@ def main(yaml_conf_filename):
 
     terrain_data.load_conf_from_yaml()
     terrain_data.load_terrain()
+    if convert_filename is not None:
+        # Only convert terrain to binary file
+        terrain_data.save_terrain(convert_filename, np.dtype(dtype))
+        return
     terrain_data.load_rivers()
     terrain_data.load_area()
+    if terrain_data.conf.get('simplify_tolerance') is not None:
+        terrain_data.simplify_2d_polylines(terrain_data.conf['simplify_tolerance'])
+    if terrain_data.conf.get('clip_margin') is not None:
+        terrain_data.clip_terrain(terrain_data.conf['clip_margin'])
 
     terrain_data.aproximate_terrain()
     terrain_data.aproximate_2d_borders()
     terrain_data.aproximate_2d_rivers()
+    if stl_filename is not None:
+        terrain_data.export_stl(stl_filename)
     
-    terrain_data.display_terrain()
+    if png_filename is not None:
+        # Headless preview instead of interactive window
+        terrain_data.render_terrain(png_filename, *png_size)
+    else:
+        terrain_data.display_terrain()
 
 if __name__ == '__main__':
     # Parse argument
     parser = argparse.ArgumentParser()
     parser.add_argument("-f", "--filename", type=str,
         help="Yaml conf file", default=None)
+    parser.add_argument("-c", "--convert", type=str,
+        help="Convert terrain to binary file (.npy) and exit", default=None)
+    parser.add_argument("-d", "--dtype", type=str, choices=['float32', 'float64'],
+        help="Type of heights in binary file", default='float64')
+    parser.add_argument("-s", "--stl", type=str,
+        help="Save aproximated surface to STL file", default=None)
+    parser.add_argument("-p", "--png", type=str,
+        help="Render terrain to PNG file instead of display", default=None)
+    parser.add_argument("--size", type=int, nargs=2, metavar=('WIDTH', 'HEIGHT'),
+        help="Size of PNG image in pixels", default=(800, 600))
     args = parser.parse_args()
-    main(args.filename)
+    main(args.filename, args.convert, args.dtype, args.stl, args.png, tuple(args.size))
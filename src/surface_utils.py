@@ -0,0 +1,56 @@
+"""
+Utilities for conversion of aproximated terrain surfaces between SciPy and OCC
+"""
+
+import numpy as np
+
+def greville_abscissae(t, k):
+    """
+    Return Greville abscissae (averages of k consecutive inner knots) of
+    b-spline basis of degree k with knot vector t. Function f(x) = x is
+    b-spline with these coefficients.
+    """
+    t = np.asarray(t, dtype=np.float64)
+    n = len(t) - k - 1
+    sums = np.concatenate(([0.0], np.cumsum(t)))
+    return (sums[k + 1:n + k + 1] - sums[1:n + 1]) / k
+
+def tck_to_bspline_params(tck):
+    """
+    Convert SciPy representation of bspline surface z = f(x, y), tuple
+    (tx, ty, c, kx, ky), to poles (nu, nv, 3), knots, multiplicities and
+    degrees of parametric surface (u, v) -> (x, y, z) with u = x and v = y.
+    Return dictionary with the same keys as arguments of make_bspline_surface.
+    """
+    tx, ty, c, kx, ky = tck
+    nu = len(tx) - kx - 1
+    nv = len(ty) - ky - 1
+    poles = np.empty((nu, nv, 3))
+    # Coefficients of x and y coordinates do not depend on the other direction
+    poles[:, :, 0] = greville_abscissae(tx, kx)[:, np.newaxis]
+    poles[:, :, 1] = greville_abscissae(ty, ky)[np.newaxis, :]
+    poles[:, :, 2] = np.asarray(c, dtype=np.float64)[:nu * nv].reshape(nu, nv)
+    uknots, umults = np.unique(tx, return_counts=True)
+    vknots, vmults = np.unique(ty, return_counts=True)
+    return {
+        'poles': poles,
+        'uknots': uknots,
+        'vknots': vknots,
+        'umults': umults,
+        'vmults': vmults,
+        'udegree': int(kx),
+        'vdegree': int(ky)
+    }
+
+def make_bspline_surface(poles, uknots, vknots, umults, vmults, udegree, vdegree):
+    """
+    Create OCC Geom_BSplineSurface (handle) from numpy arrays of poles
+    (nu, nv, 3), knots and multiplicities
+    """
+    from OCC.Geom import Geom_BSplineSurface
+    from array_utils import points_to_array2, reals_to_array1, integers_to_array1
+    surface = Geom_BSplineSurface(points_to_array2(poles),
+        reals_to_array1(uknots), reals_to_array1(vknots),
+        integers_to_array1(umults), integers_to_array1(vmults),
+        int(udegree), int(vdegree))
+    return surface.GetHandle()
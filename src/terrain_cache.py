@@ -0,0 +1,93 @@
+"""
+Persistent cache of aproximated terrain surfaces. Results are stored in
+files of cache directory named by hash of content of input files (terrain
+data and yaml configuration) and parameters of aproximation. The least
+recently used results are removed, when size of cache exceeds limit.
+"""
+
+import hashlib
+import os
+import pickle
+import tempfile
+
+# Default maximal size of cache directory in bytes
+DEFAULT_MAX_SIZE = 512 * 1024 * 1024
+# Size of blocks read from hashed files
+HASH_BLOCK_SIZE = 1024 * 1024
+CACHE_SUFFIX = '.pickle'
+
+class FitCache(object):
+    """
+    Class representing on-disk cache of aproximated surfaces
+    """
+    def __init__(self, cache_dir, max_size=DEFAULT_MAX_SIZE):
+        """Constructor of FitCache"""
+        super(FitCache, self).__init__()
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    def key(self, file_names, params):
+        """
+        Compute key of cached result from content of files and parameters
+        (anything with stable repr)
+        """
+        sha = hashlib.sha1()
+        for file_name in file_names:
+            with open(file_name, 'rb') as data_file:
+                block = data_file.read(HASH_BLOCK_SIZE)
+                while block:
+                    sha.update(block)
+                    block = data_file.read(HASH_BLOCK_SIZE)
+        sha.update(repr(params).encode('utf-8'))
+        return sha.hexdigest()
+
+    def __file_name(self, key):
+        """Return name of file with cached result"""
+        return os.path.join(self.cache_dir, key + CACHE_SUFFIX)
+
+    def load(self, key):
+        """
+        Return cached result or None, when result is not in cache
+        """
+        file_name = self.__file_name(key)
+        try:
+            with open(file_name, 'rb') as cache_file:
+                result = pickle.load(cache_file)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return None
+        # Mark result as recently used
+        os.utime(file_name, None)
+        return result
+
+    def save(self, key, result):
+        """
+        Store result to cache and remove the least recently used results
+        """
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        # Write to temporary file first to not leave broken results in cache
+        fd, tmp_file_name = tempfile.mkstemp(dir=self.cache_dir)
+        with os.fdopen(fd, 'wb') as cache_file:
+            pickle.dump(result, cache_file, protocol=2)
+        os.rename(tmp_file_name, self.__file_name(key))
+        self.__evict()
+
+    def __evict(self):
+        """
+        Remove the least recently used results until cache fits max_size
+        """
+        entries = []
+        total_size = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(CACHE_SUFFIX):
+                continue
+            stat = os.stat(os.path.join(self.cache_dir, name))
+            entries.append((stat.st_mtime, stat.st_size, name))
+            total_size += stat.st_size
+        entries.sort()
+        # The newest result is never removed
+        for mtime, size, name in entries[:-1]:
+            if total_size <= self.max_size:
+                break
+            os.remove(os.path.join(self.cache_dir, name))
+            total_size -= size